@@ -0,0 +1,242 @@
+# coding: utf-8
+
+import argparse
+import contextlib
+import glob
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from emulate import CHECK_STDIN, build
+from src import optimizer
+from src.analyzer import analyze
+from src.compiler import compile
+from src.emulator import run
+from src.optimizer import optimize
+from src.parser import parse
+from src.workload import SHAPES, generate
+
+PHASES = ["parse", "analyze", "compile", "optimize", "asm"]
+DEFAULT_SIZES = [10, 20, 40, 80]
+
+
+@contextlib.contextmanager
+def quiet():
+    # time the passes, not their logging
+    verbose, optimizer.verbose = optimizer.verbose, False
+    try:
+        yield
+    finally:
+        optimizer.verbose = verbose
+
+
+def run_once(code):
+    times = {}
+    counter = time.perf_counter
+    with quiet(), open(os.devnull, "w") as devnull, contextlib.redirect_stderr(devnull):
+        t = counter()
+        tree = parse(code)
+        times["parse"] = counter() - t
+        t = counter()
+        analyze(tree)
+        times["analyze"] = counter() - t
+        t = counter()
+        prog = compile(tree)
+        times["compile"] = counter() - t
+        raw = len(prog.instrs)
+        t = counter()
+        optimize(prog)
+        times["optimize"] = counter() - t
+        t = counter()
+        prog.asm()
+        times["asm"] = counter() - t
+    return times, raw, len(prog.instrs)
+
+
+def measure(shape, size, repeat):
+    code = generate(shape, size)
+    best = None
+    for _ in range(repeat):
+        times, raw, optimized = run_once(code)
+        best = times if best is None else {k: min(best[k], v) for k, v in times.items()}
+    return {
+        "shape": shape,
+        "size": size,
+        "source_bytes": len(code),
+        "instructions_raw": raw,
+        "instructions": optimized,
+        "phases": best,
+        "total": sum(best.values()),
+    }
+
+
+def exponent(points):
+    # least-squares slope of log(time) against log(size)
+    points = [(math.log(n), math.log(t)) for n, t in points if t > 0]
+    if len(points) < 2:
+        return None
+    mx = sum(x for x, _ in points) / len(points)
+    my = sum(y for _, y in points) / len(points)
+    den = sum((x - mx) ** 2 for x, _ in points)
+    return sum((x - mx) * (y - my) for x, y in points) / den if den else None
+
+
+def scaling(results, threshold):
+    curves, flagged = {}, []
+    for shape in dict.fromkeys(res["shape"] for res in results):
+        rows = [res for res in results if res["shape"] == shape]
+        curves[shape] = {}
+        for phase in PHASES + ["total"]:
+            k = exponent([(res["size"], res["total"] if phase == "total" else res["phases"][phase]) for res in rows])
+            curves[shape][phase] = k
+            if k is not None and k > threshold:
+                flagged.append({"shape": shape, "phase": phase, "exponent": k})
+    return curves, flagged
+
+
+def compare(results, previous):
+    old = {(res["shape"], res["size"]): res for res in previous["results"]}
+    for res in results:
+        if before := old.get((res["shape"], res["size"])):
+            ratio = res["total"] / before["total"] if before["total"] else float("inf")
+            print(f"{res['shape']:12s} {res['size']:6d}: {before['total'] * 1000:9.2f} ms → "
+                  f"{res['total'] * 1000:9.2f} ms ({ratio:.2f}x)", file=sys.stderr)
+
+
+def latency(paths):
+    def timed(*commands):
+        start = time.perf_counter()
+        for command in commands:
+            subprocess.run([sys.executable, *command], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return (time.perf_counter() - start) / len(paths)
+
+    modes = {
+        # same verbosity everywhere: the batch and server modes never log
+        "process-per-file": timed(*[["main.py", "--quiet", path] for path in paths]),
+        "batch": timed(["main.py", "--quiet", *paths]),
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        sock = os.path.join(tmp, "flo.sock")
+        server = subprocess.Popen([sys.executable, "main.py", "--quiet", f"--serve={sock}"], stderr=subprocess.DEVNULL)
+        try:
+            while not os.path.exists(sock):
+                time.sleep(0.01)
+            modes["server"] = timed(["client.py", f"--socket={sock}", *paths])
+        finally:
+            server.terminate()
+            server.wait()
+    for mode, seconds in modes.items():
+        print(f"{mode:16s}: {seconds * 1000:8.2f} ms/file", file=sys.stderr)
+    return {"files": len(paths), "ms_per_file": {mode: seconds * 1000 for mode, seconds in modes.items()}}
+
+
+def memory(sizes):
+    # peak RSS of a child compiling a growing program, whole-program vs streamed
+    def peak(*command):
+        child = subprocess.Popen([sys.executable, "main.py", *command],
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        _, status, usage = os.wait4(child.pid, 0)
+        child.returncode = os.waitstatus_to_exitcode(status)
+        return usage.ru_maxrss if child.returncode == 0 else None
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            path = os.path.join(tmp, f"functions_{size}.flo")
+            with open(path, "w") as f:
+                f.write(generate("functions", size))
+            row = {"size": size, "source_bytes": os.path.getsize(path),
+                   "whole_kb": peak(path), "stream_kb": peak("--stream", path)}
+            rows.append(row)
+            print(f"functions {size:6d}: whole {row['whole_kb']} KB, stream {row['stream_kb']} KB", file=sys.stderr)
+    return {"peak_rss": rows}
+
+
+def calls(paths, ssa=False):
+    # emulated cost of call-heavy programs: executed instructions and memory accesses per call
+    rows = []
+    for path in paths:
+        _, _, stats = run(build(path, ssa=ssa), CHECK_STDIN)
+        row = {"file": path, "instructions": stats.instructions,
+               "memory_accesses": stats.memory_reads + stats.memory_writes, "calls": stats.calls}
+        rows.append(row)
+        print(f"{path:24s}: {row['instructions']:8d} instructions, {row['memory_accesses']:8d} memory accesses, "
+              f"{row['calls']:6d} calls ({row['instructions'] / max(row['calls'], 1):.1f} instructions/call)",
+              file=sys.stderr)
+    return {"calls": rows}
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description="Benchmark the Flo compiler on generated programs")
+    parser.add_argument("--shapes", nargs="+", choices=list(SHAPES), default=list(SHAPES))
+    parser.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="scaling exponent above which a phase is flagged as super-linear")
+    parser.add_argument("--output", "-o", help="write the JSON report to this file instead of stdout")
+    parser.add_argument("--compare", help="previous JSON report to compare totals against")
+    parser.add_argument("--latency", nargs="*", metavar="FILE",
+                        help="compare per-file latency of one process per file, batch and server modes "
+                             "(default: input/*.flo)")
+    parser.add_argument("--calls", nargs="*", metavar="FILE",
+                        help="emulated instructions and memory accesses per call (default: input/fonction_*.flo)")
+    parser.add_argument("--ssa", action="store_true", help="with --calls, compile through the SSA IR")
+    parser.add_argument("--memory", action="store_true",
+                        help="compare peak memory of whole-program and --stream compilation on --sizes")
+    opts = parser.parse_args(args[1:])
+
+    if opts.latency is not None:
+        report = latency(opts.latency or sorted(glob.glob("input/*.flo")))
+        json.dump(report, sys.stdout, indent=2)
+        print()
+        return
+    if opts.calls is not None:
+        json.dump(calls(opts.calls or sorted(glob.glob("input/fonction_*.flo")), opts.ssa), sys.stdout, indent=2)
+        print()
+        return
+    if opts.memory:
+        json.dump(memory(opts.sizes), sys.stdout, indent=2)
+        print()
+        return
+
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10000))
+    results = []
+    for shape in opts.shapes:
+        for size in opts.sizes:
+            res = measure(shape, size, opts.repeat)
+            results.append(res)
+            print(f"{shape:12s} {size:6d}: " + " ".join(
+                f"{phase} {res['phases'][phase] * 1000:8.2f}ms" for phase in PHASES
+            ) + f" | total {res['total'] * 1000:9.2f}ms", file=sys.stderr)
+    curves, flagged = scaling(results, opts.threshold)
+    for flag in flagged:
+        print(f"super-linear: {flag['shape']}/{flag['phase']} ~ n^{flag['exponent']:.2f}", file=sys.stderr)
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.time(),
+            "repeat": opts.repeat,
+        },
+        "results": results,
+        "scaling": curves,
+        "flagged": flagged,
+    }
+    if opts.compare:
+        with open(opts.compare) as f:
+            compare(results, json.load(f))
+    if opts.output:
+        with open(opts.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,148 @@
+# coding: utf-8
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from emulate import CHECK_STDIN
+
+CACHE_FILE = ".check_cache.json"
+COMPILER_FILES = ["grammar.lark", "io.asm", "main.py", *sorted(glob.glob("src/*.py"))]
+
+
+def init_worker():
+    from src import optimizer
+    import src.parser  # build the grammar once per worker
+
+    optimizer.verbose = False
+
+
+def execute_native(prog, tmp):
+    asm = os.path.join(tmp, "prog.asm")
+    with open(asm, "w") as f:
+        f.write(prog.asm())
+    root = os.path.abspath(".") + os.sep
+    for command in (["nasm", "-f", "elf", "-i", root, asm], ["ld", "-m", "elf_i386", "-o", f"{tmp}/prog.exe", f"{tmp}/prog.o"]):
+        if subprocess.run(command, capture_output=True).returncode:
+            return 3, ""
+    res = subprocess.run([f"{tmp}/prog.exe"], input=CHECK_STDIN, capture_output=True, text=True, timeout=10)
+    return res.returncode, res.stdout
+
+
+def execute_emulated(prog):
+    from src.emulator import EmulatorError, run
+
+    try:
+        code, out, _ = run(prog, CHECK_STDIN)
+    except EmulatorError as e:
+        return 139, f"<{e}>"
+    return code, out
+
+
+def run_case(path, bad, native, ssa=False):
+    from main import process
+    from src.optimizer import optimize
+
+    start = time.perf_counter()
+    try:
+        with open(path, "r") as f:
+            prog = process(f.read(), ssa=ssa)
+        optimize(prog)
+    except Exception as e:
+        # run.sh exits with 2 when main.py fails
+        code, out, detail = 2, "", f"{type(e).__name__}: {e}".splitlines()[0]
+    else:
+        detail = ""
+        if native:
+            with tempfile.TemporaryDirectory() as tmp:
+                code, out = execute_native(prog, tmp)
+        else:
+            code, out = execute_emulated(prog)
+    if bad:
+        ok = code == 2
+        if not ok:
+            detail = f"expected exit code 2, got {code}"
+    else:
+        with open(path[:-4] + ".out", "r") as f:
+            expected = f.read()
+        ok = code == 0 and out == expected
+        if not ok and not detail:
+            detail = f"exit code {code}, output {out!r} instead of {expected!r}"
+    return {"path": path, "ok": ok, "seconds": time.perf_counter() - start, "detail": detail}
+
+
+def digest(path, compiler):
+    h = hashlib.sha256(compiler.encode())
+    for name in (path, path[:-4] + ".out"):
+        if os.path.exists(name):
+            with open(name, "rb") as f:
+                h.update(f.read())
+    return h.hexdigest()
+
+
+def compiler_digest():
+    h = hashlib.sha256()
+    for name in COMPILER_FILES:
+        with open(name, "rb") as f:
+            h.update(name.encode() + f.read())
+    return h.hexdigest()
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description="Run the input/ and bad_input/ test cases in parallel")
+    parser.add_argument("files", nargs="*", help="cases to run (default: input/*.flo and bad_input/*.flo)")
+    parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count())
+    parser.add_argument("--shard", default="0/1", help="run only shard K of N, as K/N")
+    parser.add_argument("--changed-only", action="store_true",
+                        help="skip cases that passed with the same sources and compiler")
+    parser.add_argument("--ssa", action="store_true", help="compile through the SSA IR")
+    parser.add_argument("--executor", choices=["auto", "native", "emulator"], default="auto")
+    opts = parser.parse_args(args[1:])
+
+    cases = [(path, path.startswith("bad_input")) for path in opts.files] or \
+            [(path, False) for path in sorted(glob.glob("input/*.flo"))] + \
+            [(path, True) for path in sorted(glob.glob("bad_input/*.flo"))]
+    k, n = map(int, opts.shard.split("/"))
+    cases = cases[k::n]
+
+    native = opts.executor == "native" or opts.executor == "auto" and bool(shutil.which("nasm") and shutil.which("ld"))
+    cache = {}
+    compiler = compiler_digest() + (":ssa" if opts.ssa else "")
+    if opts.changed_only and os.path.exists(CACHE_FILE):
+        with open(CACHE_FILE, "r") as f:
+            cache = json.load(f)
+    hashes = {path: digest(path, compiler) for path, _ in cases}
+    todo = [(path, bad) for path, bad in cases if cache.get(path) != hashes[path]]
+    skipped = len(cases) - len(todo)
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=opts.jobs, initializer=init_worker) as pool:
+        results = list(pool.map(run_case, *zip(*todo), [native] * len(todo), [opts.ssa] * len(todo))) if todo else []
+    elapsed = time.perf_counter() - start
+
+    failed = 0
+    for res in results:
+        print(f"{'ok    ' if res['ok'] else 'FAILED'} {res['seconds'] * 1000:8.1f}ms  {res['path']}"
+              + (f"  ({res['detail']})" if not res["ok"] else ""))
+        if res["ok"]:
+            cache[res["path"]] = hashes[res["path"]]
+        else:
+            cache.pop(res["path"], None)
+            failed += 1
+    with open(CACHE_FILE, "w") as f:
+        json.dump(cache, f, indent=1)
+    print(f"{len(results) - failed} passed, {failed} failed, {skipped} unchanged "
+          f"in {elapsed:.2f}s ({'native' if native else 'emulator'}, {opts.jobs} jobs)")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,40 @@
+# coding: utf-8
+
+import sys
+import time
+
+from src.server import DEFAULT_SOCKET, Client, CompileError
+
+
+def main(args):
+    options = dict(arg.partition("=")[::2] for arg in args if arg.startswith("--"))
+    paths = [arg for arg in args[1:] if not arg.startswith("--")]
+    if not paths:
+        print("usage: python3 client.py [--socket=SOCKET] [--time] NOM_FICHIER_SOURCE.flo...")
+        return 1
+    client = Client(options.get("--socket") or DEFAULT_SOCKET)
+    failed = 0
+    try:
+        for path in paths:
+            start = time.perf_counter()
+            with open(path, "r") as f:
+                source = f.read()
+            try:
+                raw, asm = client.compile(source)
+            except CompileError as e:
+                print(f"Error in {path}: {e}", file=sys.stderr)
+                failed += 1
+                continue
+            with open(path.replace(".flo", "_raw.asm"), "w") as f:
+                f.write(raw)
+            with open(path.replace(".flo", ".asm"), "w") as f:
+                f.write(asm)
+            if "--time" in options:
+                print(f"{path}: {(time.perf_counter() - start) * 1000:.2f}ms", file=sys.stderr)
+    finally:
+        client.close()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
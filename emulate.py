@@ -0,0 +1,144 @@
+# coding: utf-8
+
+import argparse
+import contextlib
+import glob
+import json
+import os
+import sys
+
+from main import process
+from src import optimizer
+from src.emulator import EmulatorError, run
+from src.optimizer import optimize
+
+# same input as check.sh
+CHECK_STDIN = "0\n1\n1\n0\n1\n1\n1\n1\n1\n1\n1\n1\n"
+
+
+def build(path, optimized=True, **options):
+    with open(path, "r") as f:
+        prog = process(f.read(), **options)
+    if optimized:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stderr(devnull):
+            optimize(prog)
+    return prog
+
+
+def check(**options):
+    failures = 0
+    totals = [0, 0]
+    for path in sorted(glob.glob("input/*.flo")):
+        name = os.path.basename(path)[:-4]
+        with open(path[:-4] + ".out", "r") as f:
+            expected = f.read()
+        counts = []
+        ok = True
+        for i, optimized in enumerate((False, True)):
+            try:
+                _, out, stats = run(build(path, optimized, **options), CHECK_STDIN)
+            except EmulatorError as e:
+                out, stats = f"<{e}>", None
+            ok &= out == expected
+            counts.append(stats.instructions if stats else 0)
+            totals[i] += counts[-1]
+        failures += not ok
+        print(f"{name:20s}: {'ok    ' if ok else 'FAILED'} {counts[0]:8d} → {counts[1]:8d} executed instructions")
+    for path in sorted(glob.glob("bad_input/*.flo")):
+        try:
+            build(path, False)
+        except Exception:
+            continue
+        failures += 1
+        print(f"{os.path.basename(path)[:-4]:20s}: FAILED (compiled)")
+    print(f"Total: {totals[0]} → {totals[1]} executed instructions, {failures} failure(s)")
+    return failures
+
+
+def ablation():
+    all_passes = list(optimizer.passes)
+    paths = sorted(glob.glob("input/*.flo"))
+
+    def executed():
+        stats = [run(build(path), CHECK_STDIN)[2] for path in paths]
+        return (sum(s.instructions for s in stats),
+                sum(s.memory_reads + s.memory_writes for s in stats))
+
+    baseline, memory = executed()
+    print(f"{'all passes':32s}: {baseline:8d} executed instructions, {memory:8d} memory accesses")
+    try:
+        for pass_ in all_passes:
+            optimizer.passes[:] = [p for p in all_passes if p is not pass_]
+            without, without_memory = executed()
+            print(f"{'without ' + pass_.__name__:32s}: {without:8d} ({without - baseline:+d}), "
+                  f"{without_memory:8d} ({without_memory - memory:+d})")
+    finally:
+        optimizer.passes[:] = all_passes
+
+
+def branches(paths, **options):
+    # taken jumps, unoptimized vs optimized
+    paths = paths or [path for path in sorted(glob.glob("input/*.flo")) if "sinon si" in open(path).read()]
+    for path in paths:
+        raw, opt = (run(build(path, optimized, **options), CHECK_STDIN)[2] for optimized in (False, True))
+        print(f"{os.path.basename(path)[:-4]:20s}: {raw.branches_taken:6d} → {opt.branches_taken:6d} taken branches, "
+              f"{raw.instructions:8d} → {opt.instructions:8d} executed instructions")
+
+
+def evaluation(**options):
+    # optimized code with and without compile-time evaluation
+    totals = [0, 0]
+    for path in sorted(glob.glob("input/*.flo")):
+        counts = [run(build(path, evaluate=evaluate, **options), CHECK_STDIN)[2].instructions
+                  for evaluate in (False, True)]
+        totals = [total + count for total, count in zip(totals, counts)]
+        print(f"{os.path.basename(path)[:-4]:20s}: {counts[0]:8d} → {counts[1]:8d} executed instructions "
+              f"(x{counts[0] / counts[1]:.1f})")
+    print(f"Total: {totals[0]} → {totals[1]} executed instructions (x{totals[0] / totals[1]:.1f})")
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description="Run Flo programs on the built-in x86 emulator")
+    parser.add_argument("file", nargs="?", help="Flo source file to run")
+    parser.add_argument("--raw", action="store_true", help="do not optimize")
+    parser.add_argument("--stdin", help="program input (default: read from stdin)")
+    parser.add_argument("--stats", action="store_true", help="print execution statistics as JSON on stderr")
+    parser.add_argument("--check", action="store_true", help="run input/ and bad_input/ against their expected results")
+    parser.add_argument("--memoize", action="store_true", help="memoize pure recursive functions")
+    parser.add_argument("--ssa", action="store_true", help="compile through the SSA IR")
+    parser.add_argument("--evaluate", action="store_true", help="run input-independent code at compile time")
+    parser.add_argument("--branches", nargs="*", metavar="FILE",
+                        help="taken branches on FILE... (default: input/ cases with sinon si)")
+    parser.add_argument("--evaluation", action="store_true",
+                        help="executed instructions on input/ with and without --evaluate")
+    parser.add_argument("--passes", action="store_true", help="executed instructions and memory accesses on input/ with each pass disabled")
+    opts = parser.parse_args(args[1:])
+    if opts.ssa and opts.memoize:
+        parser.error("--ssa cannot be combined with --memoize")
+
+    if opts.check:
+        return 1 if check(memoize=opts.memoize, ssa=opts.ssa, evaluate=opts.evaluate) else 0
+    if opts.branches is not None:
+        branches(opts.branches + ([opts.file] if opts.file else []), memoize=opts.memoize, ssa=opts.ssa,
+                 evaluate=opts.evaluate)
+        return 0
+    if opts.evaluation:
+        evaluation(memoize=opts.memoize, ssa=opts.ssa)
+        return 0
+    if opts.passes:
+        ablation()
+        return 0
+    if not opts.file:
+        parser.print_usage()
+        return 1
+    stdin = opts.stdin if opts.stdin is not None else sys.stdin.read()
+    code, out, stats = run(build(opts.file, not opts.raw, memoize=opts.memoize, ssa=opts.ssa, evaluate=opts.evaluate),
+                           stdin)
+    sys.stdout.write(out)
+    if opts.stats:
+        print(json.dumps(stats.as_dict(), indent=2), file=sys.stderr)
+    return code
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -1,44 +1,145 @@
 import sys
-from glob import glob
 
+from src import optimizer, stream
 from src.analyzer import analyze
 from src.compiler import compile
+from src.isel import select
+from src.lower import lower
 from src.optimizer import optimize
 from src.parser import parse
+from src.partial import partial_evaluate
+from src.pgo import Profile, source_hash
+from src.server import DEFAULT_SOCKET, serve
+from src.ssa import PassManager
+from src.trace import NULL_TRACER, PHASES, Tracer, count_nodes
 
 
-def process(code):
-    tree = parse(code)
-    analyze(tree)
-    asm = compile(tree)
+# compile() options the SSA backend does not implement
+SSA_UNSUPPORTED = {"memoize": "--memoize", "instrument": "--pgo-instrument", "profile": "--pgo-use"}
+
+
+# main() flags src/stream.py ignores: it compiles one function at a time with the plain stack compiler
+STREAM_UNSUPPORTED = ["--ssa", "--memoize", "--evaluate", "--pgo-instrument", "--pgo-use", "--trace", "--profile"]
+
+
+def ssa_conflicts(ssa, options):
+    return [flag for name, flag in SSA_UNSUPPORTED.items() if ssa and options.get(name)]
+
+
+def process(code, tracer=NULL_TRACER, ssa=False, evaluate=False, **options):
+    if conflicts := ssa_conflicts(ssa, options):
+        raise ValueError(f"--ssa cannot be combined with {', '.join(conflicts)}")
+    with tracer.phase("parse"):
+        tree = parse(code)
+    if tracer.enabled:
+        tracer.count("ast", nodes=count_nodes(tree))
+    with tracer.phase("analyze"):
+        analyze(tree)
+    if evaluate:
+        with tracer.phase("evaluate"):
+            folded = partial_evaluate(tree)
+        if tracer.enabled:
+            tracer.count("evaluate", folded=folded)
+    if ssa:
+        with tracer.phase("lower"):
+            module = lower(tree)
+        with tracer.phase("ssa"):
+            PassManager().run(module)
+        with tracer.phase("isel"):
+            asm = select(module)
+    else:
+        with tracer.phase("compile"):
+            asm = compile(tree, **options)
+    if tracer.enabled:
+        tracer.count("program", instructions=len(asm.instrs), labels=len(asm.labels))
     return asm
 
 
+def compile_file(path, tracer=NULL_TRACER, **options):
+    with open(path, "r") as f:
+        data = f.read()
+    if (profile := options.get("profile")) and profile.source != source_hash(data):
+        print(f"Warning: profile does not match {path}, ignoring it", file=sys.stderr)
+        options["profile"] = None
+    asm = process(data, tracer, **options)
+    with tracer.phase("asm_raw"), open(path.replace(".flo", "_raw.asm"), "w") as f:
+        f.write(asm.asm())
+    with tracer.phase("optimize"):
+        optimize(asm)
+    if tracer.enabled:
+        tracer.count("program", instructions=len(asm.instrs), labels=len(asm.labels))
+    with tracer.phase("asm"), open(path.replace(".flo", ".asm"), "w") as f:
+        f.write(asm.asm())
+
+
+def read_manifest(path):
+    with open(path, "r") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
 def main(args):
-    if False:
-        for path in glob("input/*.flo"):
-            with open(path) as fp:
-                try:
-                    tree = parse(fp.read())
-                except Exception as e:
-                    print(f"Error in {path}: {e}")
-                    raise
-
-    if len(args) < 2:
-        print("usage: python3 main.py NOM_FICHIER_SOURCE.flo")
+    options = dict(arg.partition("=")[::2] for arg in args if arg.startswith("--"))
+    args = [arg for arg in args if not arg.startswith("--")]
+    if "--quiet" in options:
+        optimizer.verbose = False
+    if "--serve" in options:
+        serve(options["--serve"] or DEFAULT_SOCKET)
+        return
+    if "--profile" in options and options["--profile"] not in PHASES:
+        print(f"{args[0]}: error: unknown phase for --profile: {options['--profile'] or '(none)'} "
+              f"(expected one of {', '.join(PHASES)})", file=sys.stderr)
+        sys.exit(2)
+    tracer = NULL_TRACER
+    if "--trace" in options or "--profile" in options:
+        tracer = Tracer(options.get("--profile") or None)
+    paths = args[1:] + (read_manifest(options["--manifest"]) if "--manifest" in options else [])
+    if "--ssa" in options and (conflicts := [flag for flag in SSA_UNSUPPORTED.values() if flag in options]):
+        print(f"{args[0]}: error: --ssa cannot be combined with {', '.join(conflicts)}", file=sys.stderr)
+        sys.exit(2)
+    if "--stream" in options and (conflicts := [flag for flag in STREAM_UNSUPPORTED if flag in options]):
+        print(f"{args[0]}: error: --stream cannot be combined with {', '.join(conflicts)}", file=sys.stderr)
+        sys.exit(2)
+    compile_options = {
+        "instrument": "--pgo-instrument" in options,
+        "profile": Profile.load(options["--pgo-use"]) if options.get("--pgo-use") else None,
+        "memoize": "--memoize" in options,
+        "ssa": "--ssa" in options,
+        "evaluate": "--evaluate" in options,
+    }
+
+    if not paths:
+        print("usage: python3 main.py [--trace[=FICHIER.json]] [--profile=PHASE] [--pgo-instrument | --pgo-use=PROFIL.json] "
+              "[--memoize] [--evaluate] [--quiet] NOM_FICHIER_SOURCE.flo")
+        print("       python3 main.py [--trace[=FICHIER.json]] [--profile=PHASE] --ssa [--evaluate] NOM_FICHIER_SOURCE.flo")
+        print("       python3 main.py [--manifest=LISTE.txt] NOM_FICHIER_SOURCE.flo...")
+        print("       python3 main.py --stream [--manifest=LISTE.txt] [--quiet] NOM_FICHIER_SOURCE.flo...  "
+              "(sans --ssa, --memoize, --evaluate, --pgo-*, --trace ni --profile)")
+        print("       python3 main.py --serve[=SOCKET]")
+    elif "--stream" in options:
+        optimizer.verbose = False
+        for path in paths:
+            stream.compile_file(path)
+    elif len(paths) == 1:
+        compile_file(paths[0], tracer, **compile_options)
+        if tracer.enabled:
+            tracer.summary()
+            trace_path = options.get("--trace") or paths[0].replace(".flo", ".trace.json")
+            if "--trace" in options:
+                tracer.dump(trace_path)
+            if "--profile" in options:
+                tracer.dump_profiles(trace_path)
     else:
-        with open(args[1], "r") as f:
-            data = f.read()
-        try:
-            asm = process(data)
-        except:
-            raise
-            print("Error in", args[1])
-        with open(args[1].replace(".flo", "_raw.asm"), "w") as f:
-            f.write(asm.asm())
-        optimize(asm)
-        with open(args[1].replace(".flo", ".asm"), "w") as f:
-            f.write(asm.asm())
+        optimizer.verbose = False
+        failed = 0
+        for path in paths:
+            try:
+                compile_file(path, **compile_options)
+            except Exception as e:
+                print(f"Error in {path}: {type(e).__name__}: {e}", file=sys.stderr)
+                failed += 1
+        if failed:
+            print(f"{failed}/{len(paths)} files failed", file=sys.stderr)
+            sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -3,16 +3,29 @@
 import glob
 import os
 
-HEADER_LEN = 7
+from emulate import build
+
+
+def header_len(prog):
+    # '%include "io.asm"', then what Program.lines() puts before the instructions
+    return 1 + len(list(prog.bss())) + len(list(prog.text()))
+
 
 stats = []
+totals = [0, 0, 0, 0]
 for path in glob.glob("input/*.flo"):
     name = os.path.basename(path)[:-4]
+    raw_prog, opt_prog = build(path, False), build(path)
     with open(f"input/{name}.asm", "r", encoding="utf-8") as f:
-        lines_asm = f.readlines()[HEADER_LEN:]
+        lines_asm = f.readlines()[header_len(opt_prog):]
     with open(f"input/{name}_raw.asm", "r", encoding="utf-8") as f:
-        lines_asm_raw = f.readlines()[HEADER_LEN:]
+        lines_asm_raw = f.readlines()[header_len(raw_prog):]
+    # static estimate from the cost model in src/x86.py
+    raw, opt = raw_prog.cost(), opt_prog.cost()
     perc = (len(lines_asm_raw) - len(lines_asm)) / len(lines_asm_raw) * 100
-    print(f"{name:20s}: {len(lines_asm_raw):3d} → {len(lines_asm):3d} lines: {perc:.2f}% reduction")
+    print(f"{name:20s}: {len(lines_asm_raw):3d} → {len(lines_asm):3d} lines: {perc:.2f}% reduction, "
+          f"{raw.cycles:4d} → {opt.cycles:4d} cycles, {raw.size:4d} → {opt.size:4d} bytes")
     stats.append(perc)
+    totals = [a + b for a, b in zip(totals, (raw.cycles, opt.cycles, raw.size, opt.size))]
 print(f"Average reduction: {sum(stats) / len(stats):.2f}%")
+print(f"Estimated total: {totals[0]} → {totals[1]} cycles, {totals[2]} → {totals[3]} bytes")
@@ -0,0 +1,57 @@
+# coding: utf-8
+
+import argparse
+import contextlib
+import os
+import sys
+
+from main import process
+from src.emulator import Machine, run
+from src.optimizer import optimize
+from src.pgo import Profile, source_hash
+
+
+def build(code, **options):
+    prog = process(code, **options)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stderr(devnull):
+        optimize(prog)
+    return prog
+
+
+def collect(code, stdin):
+    prog = build(code, instrument=True)
+    machine = Machine(prog, stdin)
+    machine.run()
+    return Profile.decode(bytes(machine.stderr), prog.counters, source_hash(code))
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description="Collect a block-count profile of a Flo program")
+    parser.add_argument("file", help="Flo source file")
+    parser.add_argument("--stdin", default="", help="program input for the training run")
+    parser.add_argument("--dump", help="decode a counter dump written to stderr by a native --pgo-instrument build "
+                                       "instead of running the emulator")
+    parser.add_argument("--output", "-o", help="profile file (default: FILE.profile.json)")
+    parser.add_argument("--compare", action="store_true",
+                        help="run the program with and without the profile and compare the executions")
+    opts = parser.parse_args(args[1:])
+
+    with open(opts.file, "r") as f:
+        code = f.read()
+    if opts.dump:
+        with open(opts.dump, "rb") as f:
+            profile = Profile.decode(f.read(), process(code, instrument=True).counters, source_hash(code))
+    else:
+        profile = collect(code, opts.stdin)
+    profile.save(opts.output or opts.file.replace(".flo", ".profile.json"))
+    for site, count in profile.counts.items():
+        print(f"{site:16s} {count:10d}", file=sys.stderr)
+    if opts.compare:
+        for name, options in (("without profile", {}), ("with profile", {"profile": profile})):
+            _, out, stats = run(build(code, **options), opts.stdin)
+            print(f"{name:16s}: {stats.instructions:8d} executed instructions, "
+                  f"{stats.branches_taken:6d} taken branches", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -5,6 +5,8 @@ from dataclasses import dataclass, field
 from lark import Token
 from more_itertools import partition
 
+from src.x86 import ARG_REGISTERS
+
 
 def analyze(tree):
     assert tree.data == "programme"
@@ -51,6 +53,10 @@ class Function:
     args: list[tuple[str, Type]]
     stack_size: int = 0
 
+    def split_args(self):
+        # (passed in ARG_REGISTERS, pushed on the stack)
+        return self.args[:len(ARG_REGISTERS)], self.args[len(ARG_REGISTERS):]
+
 
 @dataclass
 class Scope:
@@ -85,11 +91,14 @@ class Scope:
             raise ValueError(name)
 
     def child(self):
-        return Scope(parent=self, parent_function=self.parent_function, offset=self.next_address())
+        return Scope(parent=self, parent_function=self.parent_function, offset=self.offset + self.next_address())
 
     def stack_size(self):
         if self.parent_function is None:
             return 0
+        elif self.parent.parent_function is not None and self.parent.parent_function is not self.parent_function:
+            # arguments and return address of a fonction: above its frame
+            return 0
         else:
             return self.parent.stack_size() + self.next_address()
 
@@ -140,36 +149,46 @@ class Analyzer:
         items = block.children
         stmts, funcs = map(list, partition(lambda i: i.data == "fonction", items))
         for func in funcs:
-            returns, name, args, body = func.children
-            func_obj = Function(
-                name.value,
-                Type.from_str(returns),
-                [
-                    (arg.children[1].value, Type.from_str(arg.children[0])) for arg in args.children
-                ] if args else []
-            )
-            self.scope.functions[name.value] = func_obj
-            func.func_obj = func_obj
+            self.declare_function(func)
         for func in funcs:
-            _, _, _, body = func.children
-            scope = self.scope.child()
-            scope.parent_function = func.func_obj
-            for name, type in reversed(func.func_obj.args):
-                scope.declare(name, type)
-            scope.declare("$ra", Type.INTEGER)
-            scope.declare("$old_ebp", Type.INTEGER)
-            scope.offset = -func.func_obj.stack_size
-            func.func_obj.stack_size = 0
-            func.scope = scope
-            body_scope = scope.child()
-            body_scope.offset = scope.next_address() + scope.offset
-            func.body_scope = body_scope
-            Analyzer(body_scope).analyze_bloc(body)
+            self.analyze_function(func)
         for stmt in stmts:
             self.analyze(stmt)
         block.code = stmts, funcs
         block.scope = self.scope
 
+    def declare_function(self, func):
+        returns, name, args, body = func.children
+        func_obj = Function(
+            name.value,
+            Type.from_str(returns),
+            [
+                (arg.children[1].value, Type.from_str(arg.children[0])) for arg in args.children
+            ] if args else []
+        )
+        self.scope.functions[name.value] = func_obj
+        func.func_obj = func_obj
+        return func_obj
+
+    def analyze_function(self, func):
+        _, _, _, body = func.children
+        registers, stack = func.func_obj.split_args()
+        scope = self.scope.child()
+        scope.parent_function = func.func_obj
+        for name, type in reversed(stack):
+            scope.declare(name, type)
+        scope.declare("$ra", Type.INTEGER)
+        scope.declare("$old_ebp", Type.INTEGER)
+        scope.offset = -scope.next_address()
+        func.scope = scope
+        # arguments passed in registers are spilled to the first locals
+        body_scope = scope.child()
+        body_scope.offset = scope.next_address() + scope.offset
+        for name, type in registers:
+            body_scope.declare(name, type)
+        func.body_scope = body_scope
+        Analyzer(body_scope.child()).analyze_bloc(body)
+
     def analyze_expr_instr(self, expr):
         self.analyze(expr.children[0])
 
@@ -0,0 +1,106 @@
+# coding: utf-8
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+
+from src.x86 import *
+
+ALWAYS_LIVE = {r.esp, r.ebp}
+
+
+@dataclass(eq=False)
+class Block:
+    start: int
+    end: int
+    label: Optional[label] = None
+    succs: list[Block] = field(default_factory=list)
+    preds: list[Block] = field(default_factory=list)
+    entry: bool = False
+
+    def indices(self):
+        return range(self.start, self.end)
+
+    def __repr__(self):
+        return f"Block({self.label.name if self.label else '-'}, {self.start}:{self.end})"
+
+
+def ends_block(instr: Instruction):
+    return isinstance(instr, (jmp, je, jne, ret, int_))
+
+
+class CFG:
+    def __init__(self, instrs: list[Instruction]):
+        self.instrs = instrs
+        self.blocks: list[Block] = []
+        self.by_label: dict[str, Block] = {}
+        called = {instr.dst for instr in instrs if isinstance(instr, call)}
+        start = 0
+        for i, instr in enumerate(instrs):
+            if isinstance(instr, label) and i > start:
+                self.add_block(start, i)
+                start = i
+            if ends_block(instr):
+                self.add_block(start, i + 1)
+                start = i + 1
+        if start < len(instrs):
+            self.add_block(start, len(instrs))
+        for block, next_ in zip(self.blocks, self.blocks[1:] + [None]):
+            last = instrs[block.end - 1]
+            if isinstance(last, (jmp, je, jne)):
+                self.link(block, self.by_label[last.dst.name])
+            if next_ is not None and not isinstance(last, (jmp, ret, int_)):
+                self.link(block, next_)
+            if block.label and (block.label.name == "_start" or block.label.name in called):
+                block.entry = True
+        for block in self.blocks:
+            if not block.preds:
+                block.entry = True
+
+    def add_block(self, start, end):
+        first = self.instrs[start]
+        block = Block(start, end, first if isinstance(first, label) else None)
+        self.blocks.append(block)
+        if block.label:
+            self.by_label[block.label.name] = block
+
+    @staticmethod
+    def link(a: Block, b: Block):
+        a.succs.append(b)
+        b.preds.append(a)
+
+    def liveness(self):
+        gen_kill = {}
+        for block in self.blocks:
+            gen, kill = set(), set()
+            for i in reversed(block.indices()):
+                instr = self.instrs[i]
+                writes = {loc for loc in instr.writes() if not isinstance(loc, Memory)}
+                reads = {loc for loc in instr.reads() if not isinstance(loc, Memory)}
+                gen = (gen - writes) | reads
+                kill |= writes
+            gen_kill[block] = gen, kill
+        live_in = {block: set() for block in self.blocks}
+        live_out = {block: set() for block in self.blocks}
+        changed = True
+        while changed:
+            changed = False
+            for block in reversed(self.blocks):
+                out = set().union(*(live_in[succ] for succ in block.succs))
+                gen, kill = gen_kill[block]
+                new_in = gen | (out - kill)
+                if out != live_out[block] or new_in != live_in[block]:
+                    live_out[block], live_in[block] = out, new_in
+                    changed = True
+        return live_out
+
+    def live_after(self, live_out):
+        res = [set() for _ in self.instrs]
+        for block in self.blocks:
+            live = set(live_out[block]) | ALWAYS_LIVE
+            for i in reversed(block.indices()):
+                res[i] = live
+                instr = self.instrs[i]
+                writes = {loc for loc in instr.writes() if not isinstance(loc, Memory)}
+                reads = {loc for loc in instr.reads() if not isinstance(loc, Memory)}
+                live = (live - writes) | reads | ALWAYS_LIVE
+        return res
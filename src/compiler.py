@@ -1,34 +1,81 @@
 # coding: utf-8
+from collections import Counter
 from dataclasses import field
 from typing import List
 
 from lark import Token
 
 from src.analyzer import Scope, Type
+from src.licm import hoist_invariants
+from src.pgo import COUNTERS, Profile
+from src.purity import memo_candidates
 from src.x86 import *
 
+MEMO_ENTRIES = 1024  # direct-mapped, must be a power of two
+MEMO_HASH = 33
+
 
 @dataclass
 class Program:
     instrs: List[Instruction] = field(default_factory=list)
     label_count: int = 0
     labels: dict[str, label] = field(default_factory=dict)
-
-    def asm(self):
-        return "\n".join([
-            '%include "io.asm"',
+    instrument: bool = False
+    profile: Optional[Profile] = None
+    counters: list[str] = field(default_factory=list)
+    sites: Counter = field(default_factory=Counter)
+    cold: List[Instruction] = field(default_factory=list)
+    memoized: set[str] = field(default_factory=set)
+    tables: dict[str, int] = field(default_factory=dict)
+    # with a profile: how many times each frame slot is used, per function label
+    slot_uses: dict[str, Counter] = field(default_factory=dict)
+
+    def cost(self) -> Cost:
+        return program_cost(self.instrs)
+
+    def lines(self):
+        yield '%include "io.asm"'
+        yield from self.bss()
+        yield from self.text()
+        yield from map(str, self.instrs)
+
+    def bss(self):
+        yield from [
             "section .bss",
             "sinput: resb    255     ;reserve a 255 byte space in memory for the users input string",
             "v$a:    resd    1",
+        ]
+        if self.counters:
+            yield f"{COUNTERS}: resd {len(self.counters)}"
+        for name, size in self.tables.items():
+            yield f"{name}: resd {size}"
+
+    @staticmethod
+    def text():
+        yield from [
             "section .text",
             "global _start",
-            *map(str, self.instrs),
-        ])
+        ]
+
+    def asm(self):
+        return "\n".join(self.lines())
+
 
+def ends_with_return(tree):
+    if tree.data == "bloc":
+        return bool(tree.children) and ends_with_return(tree.children[-1])
+    if tree.data == "si":
+        _, if_block, *else_block = tree.children
+        return bool(else_block) and ends_with_return(if_block) and ends_with_return(else_block[0])
+    return tree.data == "retourner"
 
-def compile(prog):
+
+def compile(prog, instrument=False, profile=None, memoize=False):
     stmts, funcs = prog.code
-    output = Program()
+    output = Program(instrument=instrument, profile=profile)
+    if memoize:
+        output.memoized = memo_candidates(prog)
+    hoist_invariants(prog)
     comp = Compiler(output, prog.scope)
     for func in funcs:
         comp.compile_function(func)
@@ -40,9 +87,16 @@ def compile(prog):
 class Compiler:
     program: Program
     scope: Scope
+    frame: str = "_start"
+    weight: int = 1  # profile count of the block being compiled
 
     def i(self, s: Instruction):
         self.program.instrs.append(s)
+        if self.program.profile:
+            uses = self.program.slot_uses.setdefault(self.frame, Counter())
+            for op in s.__dict__.values():
+                if isinstance(op, Memory) and op.base == r.ebp:
+                    uses[op] += self.weight
         if type(s) is label:
             if existing := self.program.labels.get(s.name):
                 assert existing == s
@@ -55,34 +109,122 @@ class Compiler:
         self.program.labels[name] = res
         return res
 
+    def site(self, kind):
+        self.program.sites[kind] += 1
+        return f"{kind}{self.program.sites[kind]}"
+
+    def count(self, name):
+        if self.program.instrument:
+            self.i(add(Memory(None, 4 * len(self.program.counters), symbol=COUNTERS), imm(1)))
+            self.program.counters.append(name)
+        if self.program.profile:
+            self.weight = self.program.profile[name]
+
+    def compile_cold(self, start, block, resume):
+        # profile says this block never runs: move it after the function body
+        first = len(self.program.instrs)
+        self.weight = 0
+        self.i(start)
+        self.compile(block)
+        if not ends_with_return(block):
+            self.i(jmp(resume))
+        self.program.cold += self.program.instrs[first:]
+        del self.program.instrs[first:]
+
+    def flush_cold(self):
+        self.program.instrs += self.program.cold
+        self.program.cold.clear()
+
     def compile_function(self, func):
         obj = func.func_obj
         _, _, _, body = func.children
+        self.frame = f"_{obj.name}"
         self.i(label(f"_{obj.name}"))
         end = self.reserve_label(f"{obj.name}_end")
         self.i(push(r.ebp))
         self.i(mov(r.ebp, r.esp))
-        self.i(sub(r.esp, imm(obj.stack_size - func.body_scope.offset)))
+        # arguments passed in registers become the first locals
+        registers, _ = obj.split_args()
+        for reg in ARG_REGISTERS[:len(registers)]:
+            self.i(push(reg))
+        self.i(sub(r.esp, imm(obj.stack_size - func.body_scope.offset - 4 * len(registers))))
+        self.count(f"f:{obj.name}")
+        if memo := obj.name in self.program.memoized:
+            done = self.reserve_label(f"{obj.name}_memo")
+            self.memo_lookup(func, done)
         self.compile_bloc(body)
         self.i(end)
+        if memo:
+            self.memo_store(func)
+            self.i(done)
         self.i(mov(r.esp, r.ebp))
         self.i(pop(r.ebp))
         self.i(ret())
+        self.flush_cold()
+
+    def memo_slot(self, func):
+        # ecx = offset of the table entry for the current arguments: [valid, args..., result]
+        args = [self.get_offset_in(func.body_scope, name) for name, _ in func.func_obj.args]
+        self.i(mov(r.ecx, args[0]))
+        for arg in args[1:]:
+            self.i(mov(r.edx, imm(MEMO_HASH)))
+            self.i(imul(r.ecx, r.edx))
+            self.i(add(r.ecx, arg))
+        self.i(and_(r.ecx, imm(MEMO_ENTRIES - 1)))
+        self.i(mov(r.edx, imm(4 * (len(args) + 2))))
+        self.i(imul(r.ecx, r.edx))
+        return args
+
+    def memo_lookup(self, func, done):
+        table = f"memo${func.func_obj.name}"
+        args = self.memo_slot(func)
+        self.program.tables[table] = MEMO_ENTRIES * (len(args) + 2)
+        miss = self.new_label()
+        self.i(cmp(Memory(r.ecx, 0, symbol=table), imm(0)))
+        self.i(je(miss))
+        for k, arg in enumerate(args, 1):
+            self.i(mov(r.eax, arg))
+            self.i(cmp(Memory(r.ecx, 4 * k, symbol=table), r.eax))
+            self.i(jne(miss))
+        self.i(mov(r.eax, Memory(r.ecx, 4 * (len(args) + 1), symbol=table)))
+        self.i(jmp(done))
+        self.i(miss)
+
+    def memo_store(self, func):
+        # eax holds the result: the arguments are never assigned, so the slot is the same
+        table = f"memo${func.func_obj.name}"
+        args = self.memo_slot(func)
+        self.i(mov(Memory(r.ecx, 0, symbol=table), imm(1)))
+        for k, arg in enumerate(args, 1):
+            self.i(mov(r.edx, arg))
+            self.i(mov(Memory(r.ecx, 4 * k, symbol=table), r.edx))
+        self.i(mov(Memory(r.ecx, 4 * (len(args) + 1), symbol=table), r.eax))
 
     def compile_main(self, main):
+        self.frame, self.weight = "_start", 1
         self.i(label("_start"))
         self.i(push(r.ebp))
         self.i(mov(r.ebp, r.esp))
         self.i(sub(r.esp, imm(self.scope.parent_function.stack_size)))
         for stmt in main:
             self.compile(stmt)
+        if self.program.instrument:
+            self.i(mov(r.eax, imm(4)))  # write(stderr, counters)
+            self.i(mov(r.ebx, imm(2)))
+            self.i(mov(r.ecx, Global(COUNTERS)))
+            self.i(mov(r.edx, imm(4 * len(self.program.counters))))
+            self.i(int_(0x80))
         self.i(mov(r.eax, imm(1)))  # exit()
         self.i(mov(r.ebx, imm(0)))
         self.i(int_(0x80))
+        self.flush_cold()
 
     def compile(self, tree):
         if type(tree) == Token:
             return getattr(self, "compile_" + tree.type)(tree)
+        if (slot := getattr(tree, "hoisted", None)) is not None:
+            self.i(push(slot))
+            return
         return getattr(self, "compile_" + tree.data)(tree)
 
     def compile_expr_add(self, expr):
@@ -114,10 +256,14 @@ class Compiler:
             builtin(args)
             return
         func = self.scope.get_function(nom.value)
+        registers, stack = func.split_args()
         for arg in reversed(args):
             self.compile(arg)
-        self.i(call(f"_{nom.value}"))
-        self.i(add(r.esp, imm(sum(type.size() for _, type in func.args))))
+        for reg in ARG_REGISTERS[:len(registers)]:
+            self.i(pop(reg))
+        self.i(call(f"_{nom.value}", len(registers)))
+        if stack:
+            self.i(add(r.esp, imm(sum(type.size() for _, type in stack))))
         if func.return_type != Type.VOID:
             self.i(push(r.eax))
 
@@ -155,12 +301,12 @@ class Compiler:
         self.i(mov(self.get_offset(name.value), r.eax))
 
     def compile_bloc(self, block):
-        comp = Compiler(self.program, block.scope)
+        comp = Compiler(self.program, block.scope, self.frame, self.weight)
         for stmt in block.children:
             comp.compile(stmt)
 
     def compile_ENTIER(self, entier):
-        self.i(push(imm(entier.value)))
+        self.i(push(imm(int(entier.value))))
 
     def compile_affectation(self, affectation):
         var, val = affectation.children
@@ -191,36 +337,96 @@ class Compiler:
         self.i(push(r.eax))
 
     def get_offset(self, name) -> Memory:
-        off = -self.scope.get_offset(name)
-        return Memory(r.ebp, off)
+        return self.get_offset_in(self.scope, name)
+
+    @staticmethod
+    def get_offset_in(scope, name) -> Memory:
+        return Memory(r.ebp, -scope.get_offset(name))
 
     def compile_si(self, si):
         cond, if_block, *else_block = si.children
+        site = self.site("si")
+        outer = self.weight
         self.compile(cond)
         self.i(pop(r.eax))
         self.i(cmp(r.eax, imm(0)))
+        if (profile := self.program.profile) and profile[f"{site}.then"] + profile[f"{site}.else"]:
+            taken, not_taken = profile[f"{site}.then"], profile[f"{site}.else"]
+            if taken == 0 or not_taken == 0 or else_block and taken > not_taken:
+                self.compile_si_profiled(site, if_block, else_block[0] if else_block else None, taken, not_taken)
+                self.weight = outer
+                return
         orelse = self.new_label()
         self.i(je(orelse))
+        self.count(f"{site}.then")
         self.compile(if_block)
         endif = self.new_label()
-        self.i(jmp(endif))
+        if not ends_with_return(if_block):
+            self.i(jmp(endif))
         self.i(orelse)
+        self.count(f"{site}.else")
         if else_block:
             self.compile(else_block[0])
         self.i(endif)
+        self.weight = outer
+
+    def compile_si_profiled(self, site, if_block, else_block, taken, not_taken):
+        endif = self.new_label()
+        if taken == 0:
+            self.i(jne(then := self.new_label()))
+            self.compile_cold(then, if_block, endif)
+            self.count(f"{site}.else")
+            if else_block:
+                self.compile(else_block)
+        elif not_taken == 0:
+            self.i(je(orelse := self.new_label()))
+            self.count(f"{site}.then")
+            self.compile(if_block)
+            if else_block:
+                self.compile_cold(orelse, else_block, endif)
+            else:
+                self.i(orelse)
+        else:
+            # the branch laid out last needs no jump to endif: keep the hotter one there
+            then = self.new_label()
+            self.i(jne(then))
+            self.count(f"{site}.else")
+            self.compile(else_block)
+            if not ends_with_return(else_block):
+                self.i(jmp(endif))
+            self.i(then)
+            self.count(f"{site}.then")
+            self.compile(if_block)
+        self.i(endif)
 
     def compile_tantque(self, tantque):
+        # rotated into "si (cond) { faire { body } tantque (cond) }": one branch per iteration
         cond, block = tantque.children
-        start = self.new_label()
+        site = self.site("tq")
+        top = self.new_label()
         end = self.new_label()
-        self.i(start)
+        outer = self.weight
+        self.count(f"{site}.entry")
         self.compile(cond)
         self.i(pop(r.eax))
         self.i(cmp(r.eax, imm(0)))
         self.i(je(end))
+        for expr, slot in tantque.invariants:
+            # preheader: the loop runs at least once from here, later evaluations load the slot
+            self.compile(expr)
+            self.i(pop(r.eax))
+            self.i(mov(slot, r.eax))
+            expr.hoisted = slot
+        self.i(align(16))
+        self.i(top)
+        self.count(f"{site}.body")
         self.compile(block)
-        self.i(jmp(start))
+        self.compile(cond)
+        self.i(pop(r.eax))
+        self.i(cmp(r.eax, imm(0)))
+        self.i(jne(top))
         self.i(end)
+        self.weight = outer
 
     def compile_expr_unaire(self, expr):
         op, val = expr.children
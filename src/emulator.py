@@ -0,0 +1,395 @@
+# coding: utf-8
+from __future__ import annotations
+
+from collections import Counter
+from dataclasses import dataclass, field
+
+from src.compiler import Program
+from src.x86 import *
+
+MASK = 0xFFFFFFFF
+STACK_TOP = 0xBFFFF000
+GLOBALS_BASE = 0x08100000
+RETURN_BASE = 0x08000000
+SYS_EXIT = 1
+SYS_WRITE = 4
+
+
+def signed(value):
+    value &= MASK
+    return value - (1 << 32) if value & 0x80000000 else value
+
+
+class EmulatorError(Exception):
+    pass
+
+
+class Trap(EmulatorError):
+    pass
+
+
+@dataclass
+class Stats:
+    instructions: int = 0
+    memory_reads: int = 0
+    memory_writes: int = 0
+    syscalls: int = 0
+    branches_taken: int = 0
+    calls: int = 0
+    profile: Counter = field(default_factory=Counter)
+    opcodes: Counter = field(default_factory=Counter)
+
+    def as_dict(self):
+        return {
+            "instructions": self.instructions,
+            "memory_reads": self.memory_reads,
+            "memory_writes": self.memory_writes,
+            "syscalls": self.syscalls,
+            "branches_taken": self.branches_taken,
+            "calls": self.calls,
+            "profile": dict(self.profile.most_common()),
+            "opcodes": dict(self.opcodes.most_common()),
+        }
+
+
+class Exit(Exception):
+    def __init__(self, code):
+        self.code = code
+
+
+@dataclass
+class Machine:
+    program: Program
+    stdin: str = ""
+    max_steps: int = 50_000_000
+    stats: Stats = field(default_factory=Stats)
+    output: list[str] = field(default_factory=list)
+    regs: dict[str, int] = field(default_factory=dict)
+    memory: dict[int, int] = field(default_factory=dict)
+    flags: dict[str, bool] = field(default_factory=dict)
+    buffers: dict[int, str] = field(default_factory=dict)
+    stderr: bytearray = field(default_factory=bytearray)
+    globals: dict[str, int] = field(default_factory=dict)
+
+    def __post_init__(self):
+        self.instrs = self.program.instrs
+        self.targets = {}
+        self.regions = []
+        region = None
+        for i, instr in enumerate(self.instrs):
+            if type(instr) is label:
+                self.targets[instr.name] = i
+                region = instr.name
+            self.regions.append(region)
+        self.lines = iter(self.stdin.splitlines())
+        self.handlers = {}
+        self.regs.update(eax=0, ebx=0, ecx=0, edx=0, esi=0, edi=0, ebp=0, esp=STACK_TOP)
+
+    def run(self):
+        if "_start" not in self.targets:
+            raise EmulatorError("no _start label")
+        self.pc = self.targets["_start"]
+        stats = self.stats
+        instrs = self.instrs
+        regions = self.regions
+        handlers = self.handlers
+        try:
+            while True:
+                if self.pc >= len(instrs):
+                    raise EmulatorError("execution ran past the end of the program")
+                instr = instrs[self.pc]
+                self.pc += 1
+                kind = type(instr)
+                if kind is label or kind is align:
+                    continue
+                stats.instructions += 1
+                stats.profile[regions[self.pc - 1]] += 1
+                stats.opcodes[kind.__name__] += 1
+                if stats.instructions > self.max_steps:
+                    raise EmulatorError(f"step limit of {self.max_steps} exceeded")
+                if (handler := handlers.get(kind)) is None:
+                    handler = handlers[kind] = getattr(self, "exec_" + kind.__name__.rstrip("_"))
+                handler(instr)
+        except Exit as e:
+            return e.code
+
+    def stdout(self):
+        return "".join(self.output)
+
+    # operands
+
+    def address(self, mem: Memory):
+        addr = mem.offset
+        if mem.base:
+            addr += self.read(mem.base)
+        if mem.symbol:
+            addr += self.global_address(mem.symbol)
+        if mem.index_scale:
+            index, scale = mem.index_scale
+            addr += self.read(index) * scale
+        return addr & MASK
+
+    def global_address(self, name):
+        if (addr := self.globals.get(name)) is None:
+            addr = self.globals[name] = GLOBALS_BASE + 0x100000 * len(self.globals)
+        return addr
+
+    def read(self, op):
+        if isinstance(op, Register):
+            name = op.name
+            if len(name) == 2 and name[1] == "l":
+                return self.regs[f"e{name[0]}x"] & 0xFF
+            return self.regs[name]
+        if isinstance(op, Memory):
+            self.stats.memory_reads += 1
+            return self.memory.get(self.address(op), 0)
+        if isinstance(op, imm):
+            return int(op.value) & MASK
+        if isinstance(op, Global):
+            return self.global_address(op.name)
+        raise EmulatorError(f"cannot read {op!r}")
+
+    def write(self, op, value):
+        if isinstance(op, Register):
+            name = op.name
+            if len(name) == 2 and name[1] == "l":
+                full = f"e{name[0]}x"
+                self.regs[full] = (self.regs[full] & ~0xFF & MASK) | (value & 0xFF)
+            else:
+                self.regs[name] = value & MASK
+        elif isinstance(op, Memory):
+            self.stats.memory_writes += 1
+            self.memory[self.address(op)] = value & MASK
+        else:
+            raise EmulatorError(f"cannot write {op!r}")
+
+    def width(self, op):
+        if isinstance(op, Register) and len(op.name) == 2 and op.name[1] == "l":
+            return 8
+        return 32
+
+    def push_value(self, value):
+        self.regs["esp"] = (self.regs["esp"] - 4) & MASK
+        self.stats.memory_writes += 1
+        self.memory[self.regs["esp"]] = value & MASK
+
+    def pop_value(self):
+        self.stats.memory_reads += 1
+        value = self.memory.get(self.regs["esp"], 0)
+        self.regs["esp"] = (self.regs["esp"] + 4) & MASK
+        return value
+
+    def set_flags(self, result, width=32, carry=False, overflow=False):
+        mask = (1 << width) - 1
+        result &= mask
+        self.flags = {
+            "z": result == 0,
+            "s": bool(result >> (width - 1)),
+            "c": carry,
+            "o": overflow,
+        }
+
+    def condition(self, cc):
+        f = self.flags
+        if not f:
+            raise EmulatorError(f"flags read before being set ({cc})")
+        if cc == "e":
+            return f["z"]
+        if cc == "ne":
+            return not f["z"]
+        if cc == "l":
+            return f["s"] != f["o"]
+        if cc == "le":
+            return f["z"] or f["s"] != f["o"]
+        if cc == "g":
+            return not f["z"] and f["s"] == f["o"]
+        if cc == "ge":
+            return f["s"] == f["o"]
+        raise EmulatorError(f"unknown condition {cc}")
+
+    def jump(self, target: label):
+        self.stats.branches_taken += 1
+        self.pc = self.targets[target.name]
+
+    def arith(self, dst, src, op, subtract=False):
+        width = self.width(dst)
+        mask = (1 << width) - 1
+        a, b = self.read(dst) & mask, self.read(src) & mask
+        result = op(a, b)
+        sign = 1 << (width - 1)
+        if subtract:
+            carry = a < b
+            overflow = bool((a ^ b) & (a ^ result) & sign)
+        else:
+            carry = result > mask
+            overflow = bool(~(a ^ b) & (a ^ result) & sign)
+        self.set_flags(result, width, carry, overflow)
+        return result & mask
+
+    # instructions
+
+    def exec_mov(self, instr: mov):
+        self.write(instr.dst, self.read(instr.src))
+
+    def exec_movzx(self, instr: movzx):
+        self.write(instr.dst, self.read(instr.src) & 0xFF)
+
+    def exec_add(self, instr: add):
+        self.write(instr.dst, self.arith(instr.dst, instr.src, lambda a, b: a + b))
+
+    def exec_sub(self, instr: sub):
+        self.write(instr.dst, self.arith(instr.dst, instr.src, lambda a, b: a - b, subtract=True))
+
+    def exec_cmp(self, instr: cmp):
+        self.arith(instr.dst, instr.src, lambda a, b: a - b, subtract=True)
+
+    def exec_and(self, instr: and_):
+        result = self.read(instr.dst) & self.read(instr.src)
+        self.set_flags(result, self.width(instr.dst))
+        self.write(instr.dst, result)
+
+    def exec_or(self, instr: or_):
+        result = self.read(instr.dst) | self.read(instr.src)
+        self.set_flags(result, self.width(instr.dst))
+        self.write(instr.dst, result)
+
+    def exec_neg(self, instr: neg):
+        value = self.read(instr.dst)
+        result = -value & MASK
+        self.set_flags(result, 32, value != 0, value == 0x80000000)
+        self.write(instr.dst, result)
+
+    def exec_imul(self, instr: imul):
+        full = signed(self.read(instr.dst)) * signed(self.read(instr.src))
+        overflow = full != signed(full)
+        self.set_flags(full, 32, overflow, overflow)
+        self.write(instr.dst, full)
+
+    def exec_idiv(self, instr: idiv):
+        divisor = signed(self.read(instr.src))
+        dividend = (self.regs["edx"] << 32) | self.regs["eax"]
+        if dividend & (1 << 63):
+            dividend -= 1 << 64
+        if divisor == 0:
+            raise Trap("division by zero")
+        quotient = abs(dividend) // abs(divisor)
+        if (dividend < 0) != (divisor < 0):
+            quotient = -quotient
+        remainder = dividend - quotient * divisor
+        if quotient != signed(quotient):
+            raise Trap("division overflow")
+        self.regs["eax"] = quotient & MASK
+        self.regs["edx"] = remainder & MASK
+        self.flags = {}
+
+    def exec_push(self, instr: push):
+        self.push_value(self.read(instr.src))
+
+    def exec_pop(self, instr: pop):
+        self.write(instr.dst, self.pop_value())
+
+    def exec_set(self, instr, cc):
+        self.write(instr.dst, int(self.condition(cc)))
+
+    def exec_sete(self, instr: sete):
+        self.exec_set(instr, "e")
+
+    def exec_setne(self, instr: setne):
+        self.exec_set(instr, "ne")
+
+    def exec_setl(self, instr: setl):
+        self.exec_set(instr, "l")
+
+    def exec_setle(self, instr: setle):
+        self.exec_set(instr, "le")
+
+    def exec_setg(self, instr: setg):
+        self.exec_set(instr, "g")
+
+    def exec_setge(self, instr: setge):
+        self.exec_set(instr, "ge")
+
+    def exec_jmp(self, instr: jmp):
+        self.jump(instr.dst)
+
+    def exec_je(self, instr: je):
+        if self.condition("e"):
+            self.jump(instr.dst)
+
+    def exec_jne(self, instr: jne):
+        if self.condition("ne"):
+            self.jump(instr.dst)
+
+    def exec_nop(self, instr: nop):
+        pass
+
+    def exec_leave(self, instr: leave):
+        self.regs["esp"] = self.regs["ebp"]
+        self.regs["ebp"] = self.pop_value()
+
+    def exec_call(self, instr: call):
+        self.stats.calls += 1
+        if (target := self.targets.get(instr.dst)) is not None:
+            self.push_value(RETURN_BASE + self.pc)
+            self.pc = target
+        elif native := getattr(self, "native_" + instr.dst, None):
+            native()
+        else:
+            raise EmulatorError(f"call to unknown routine {instr.dst}")
+
+    def exec_ret(self, instr: ret):
+        self.pc = self.pop_value() - RETURN_BASE
+
+    def exec_int(self, instr: int_):
+        if instr.value != 0x80:
+            raise EmulatorError(f"unsupported interrupt {instr.value:#x}")
+        self.stats.syscalls += 1
+        if self.regs["eax"] == SYS_EXIT:
+            raise Exit(self.regs["ebx"] & 0xFF)
+        if self.regs["eax"] == SYS_WRITE:
+            fd, buf, count = self.regs["ebx"], self.regs["ecx"], self.regs["edx"]
+            data = b"".join(self.memory.get(buf + i, 0).to_bytes(4, "little") for i in range(0, count, 4))[:count]
+            if fd == 1:
+                self.output.append(data.decode())
+            elif fd == 2:
+                self.stderr += data
+            else:
+                raise EmulatorError(f"write to unsupported file descriptor {fd}")
+            self.regs["eax"] = count
+            return
+        raise EmulatorError(f"unsupported syscall {self.regs['eax']}")
+
+    # io.asm routines
+
+    def native_readline(self):
+        line = next(self.lines, None)
+        self.stats.syscalls += 1 if line is None else len(line) + 1
+        self.buffers[self.regs["eax"]] = line or ""
+
+    def native_atoi(self):
+        text = self.buffers.get(self.regs["eax"], "").lstrip(" ")
+        sign = 1
+        if text[:1] in ("+", "-"):
+            sign = -1 if text[0] == "-" else 1
+            text = text[1:]
+        value = 0
+        for char in text:
+            if not "0" <= char <= "9":
+                break
+            value = value * 10 + int(char)
+        self.regs["eax"] = (sign * value) & MASK
+
+    def native_iprintLF(self):
+        value = signed(self.regs["eax"])
+        if value < 0:
+            self.regs["ebx"] = ord("-")
+        text = str(value)
+        self.stats.syscalls += len(text) + 1
+        self.output.append(text + "\n")
+        self.flags = {}
+
+
+def run(program: Program, stdin="", max_steps=50_000_000):
+    machine = Machine(program, stdin, max_steps)
+    code = machine.run()
+    return code, machine.stdout(), machine.stats
@@ -0,0 +1,209 @@
+# coding: utf-8
+from src.analyzer import Type
+
+ARITHMETIC = {"add", "sub", "mul", "div", "mod", "and", "or"}
+COMPARISONS = {"eq", "ne", "lt", "le", "gt", "ge"}
+BINARY = ARITHMETIC | COMPARISONS
+UNARY = {"neg", "not"}
+COMMUTATIVE = {"add", "mul", "and", "or", "eq", "ne"}
+EFFECTS = {"call", "lire", "ecrire"}
+TERMINATORS = {"jmp", "br", "ret", "exit"}
+
+MASK = 0xFFFFFFFF
+
+
+def wrap(value):
+    value &= MASK
+    return value - (1 << 32) if value & 0x80000000 else value
+
+
+def divide(a, b):
+    # what "mov edx, 0; idiv" computes, or None when it traps
+    if b == 0:
+        return None
+    dividend = a & MASK
+    quotient = dividend // abs(b)
+    if b < 0:
+        quotient = -quotient
+    if quotient != wrap(quotient):
+        return None
+    return quotient, dividend - quotient * b
+
+
+FOLD = {
+    "add": lambda a, b: a + b,
+    "sub": lambda a, b: a - b,
+    "mul": lambda a, b: a * b,
+    "div": lambda a, b: (res := divide(a, b)) and res[0],
+    "mod": lambda a, b: (res := divide(a, b)) and res[1],
+    "and": lambda a, b: a & b,
+    "or": lambda a, b: a | b,
+    "eq": lambda a, b: int(a == b),
+    "ne": lambda a, b: int(a != b),
+    "lt": lambda a, b: int(a < b),
+    "le": lambda a, b: int(a <= b),
+    "gt": lambda a, b: int(a > b),
+    "ge": lambda a, b: int(a >= b),
+    "neg": lambda a: -a,
+    "not": lambda a: int(a == 0),
+}
+
+
+def fold(op, *args):
+    res = FOLD[op](*args)
+    return None if res is None else wrap(res)
+
+
+class Instr:
+    # dest: value id or None; args: value ids (phi: one per predecessor of block);
+    # extra: constant value, callee name, parameter index or branch targets
+    __slots__ = ("op", "dest", "args", "extra", "block")
+
+    def __init__(self, op, dest=None, args=(), extra=None):
+        self.op = op
+        self.dest = dest
+        self.args = list(args)
+        self.extra = extra
+        self.block = None
+
+    def has_effects(self, func):
+        if self.op in EFFECTS or self.op in TERMINATORS:
+            return True
+        if self.op in ("div", "mod"):
+            return not func.safe_divisor(self.args[1])
+        return False
+
+    def __str__(self):
+        lhs = f"v{self.dest} = " if self.dest is not None else ""
+        args = ", ".join(f"v{arg}" for arg in self.args)
+        if self.op == "const":
+            return f"{lhs}const {self.extra}"
+        if self.op == "param":
+            return f"{lhs}param {self.extra}"
+        if self.op == "call":
+            return f"{lhs}call {self.extra}({args})"
+        if self.op == "phi":
+            return f"{lhs}phi " + ", ".join(f"[b{pred.id}: v{arg}]" for pred, arg in zip(self.block.preds, self.args))
+        if self.op in ("jmp", "br"):
+            targets = ", ".join(f"b{block.id}" for block in self.extra)
+            return f"{self.op} {args + ', ' if args else ''}{targets}"
+        return f"{lhs}{self.op} {args}".rstrip()
+
+
+class Block:
+    __slots__ = ("id", "phis", "instrs", "preds", "succs")
+
+    def __init__(self, id):
+        self.id = id
+        self.phis: list[Instr] = []
+        self.instrs: list[Instr] = []
+        self.preds: list[Block] = []
+        self.succs: list[Block] = []
+
+    @property
+    def term(self):
+        return self.instrs[-1] if self.instrs and self.instrs[-1].op in TERMINATORS else None
+
+    def append(self, instr):
+        instr.block = self
+        (self.phis if instr.op == "phi" else self.instrs).append(instr)
+        return instr
+
+    def __repr__(self):
+        return f"b{self.id}"
+
+
+class Function:
+    __slots__ = ("name", "return_type", "params", "blocks", "types", "defs", "block_count")
+
+    def __init__(self, name, return_type, params):
+        self.name = name
+        self.return_type = return_type
+        self.params = params
+        self.blocks: list[Block] = []
+        self.types: list[Type] = []
+        self.defs: list[Instr] = []
+        self.block_count = 0
+
+    @property
+    def entry(self):
+        return self.blocks[0]
+
+    def new_block(self):
+        block = Block(self.block_count)
+        self.block_count += 1
+        self.blocks.append(block)
+        return block
+
+    def new_value(self, type, instr):
+        instr.dest = len(self.types)
+        self.types.append(type)
+        self.defs.append(instr)
+        return instr.dest
+
+    def emit(self, block, op, type, args=(), extra=None):
+        instr = Instr(op, None, args, extra)
+        if type is not None:
+            self.new_value(type, instr)
+        block.append(instr)
+        return instr
+
+    def constant(self, value):
+        instr = self.defs[value]
+        return instr.extra if instr is not None and instr.op == "const" else None
+
+    def safe_divisor(self, value):
+        # edx is zeroed, not sign-extended: only |divisor| >= 2 never overflows
+        return abs(self.constant(value) or 0) >= 2
+
+    def instructions(self):
+        for block in self.blocks:
+            yield from block.phis
+            yield from block.instrs
+
+    def link(self, pred, succ):
+        pred.succs.append(succ)
+        succ.preds.append(pred)
+
+    def unlink(self, pred, succ):
+        # drop the edge and the matching phi operands
+        index = succ.preds.index(pred)
+        del succ.preds[index]
+        for phi in succ.phis:
+            del phi.args[index]
+        pred.succs.remove(succ)
+
+    def replace_uses(self, mapping):
+        if not mapping:
+            return
+
+        def find(value):
+            while value in mapping:
+                value = mapping[value]
+            return value
+
+        for instr in self.instructions():
+            instr.args = [find(arg) for arg in instr.args]
+
+    def remove(self, instr):
+        (instr.block.phis if instr.op == "phi" else instr.block.instrs).remove(instr)
+        if instr.dest is not None:
+            self.defs[instr.dest] = None
+
+    def __str__(self):
+        params = ", ".join(f"v{param}" for param in self.params)
+        lines = [f"function {self.name}({params}):"]
+        for block in self.blocks:
+            preds = ", ".join(f"b{pred.id}" for pred in block.preds)
+            lines.append(f"  b{block.id}:" + (f"  ; preds {preds}" if preds else ""))
+            lines += [f"    {instr}" for instr in (*block.phis, *block.instrs)]
+        return "\n".join(lines)
+
+
+class Module:
+    def __init__(self):
+        self.functions: dict[str, Function] = {}
+        self.removable_calls: set[str] = set()
+
+    def __str__(self):
+        return "\n\n".join(map(str, self.functions.values()))
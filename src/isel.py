@@ -0,0 +1,203 @@
+# coding: utf-8
+from src.compiler import Program
+from src.ssa import reverse_postorder
+from src.x86 import *
+
+SETCC = {"eq": sete, "ne": setne, "lt": setl, "le": setle, "gt": setg, "ge": setge}
+SIMPLE = {"add": add, "sub": sub, "and": and_, "or": or_}
+
+
+def select(module):
+    # SSA -> x86: every value lives in its own frame slot, phis go through a shadow slot
+    program = Program()
+    for func in module.functions.values():
+        if func.name != "_main":
+            Selector(program, func).function()
+    Selector(program, module.functions["_main"]).function()
+    return program
+
+
+class Selector:
+    def __init__(self, program, func):
+        self.program = program
+        self.func = func
+        self.slots: dict[int, Memory] = {}
+        self.shadows: dict[int, Memory] = {}
+        self.labels = {}
+        self.frame = 0
+
+    def i(self, instr):
+        self.program.instrs.append(instr)
+
+    def new_label(self):
+        self.program.label_count += 1
+        res = label(f"l{self.program.label_count}")
+        self.program.labels[res.name] = res
+        return res
+
+    def slot(self, value):
+        if (slot := self.slots.get(value)) is None:
+            definition = self.func.defs[value]
+            if definition.op == "param" and definition.extra >= len(ARG_REGISTERS):
+                slot = Memory(r.ebp, 8 + 4 * (definition.extra - len(ARG_REGISTERS)))
+            else:
+                slot = self.local()
+            self.slots[value] = slot
+        return slot
+
+    def shadow(self, phi):
+        if (slot := self.shadows.get(phi.dest)) is None:
+            slot = self.shadows[phi.dest] = self.local()
+        return slot
+
+    def local(self):
+        self.frame += 4
+        return Memory(r.ebp, -self.frame)
+
+    def operand(self, value):
+        if (const := self.func.constant(value)) is not None:
+            return imm(const)
+        return self.slot(value)
+
+    def load(self, reg, value):
+        self.i(mov(reg, self.operand(value)))
+
+    def function(self):
+        order = reverse_postorder(self.func)
+        self.labels = {block.id: self.new_label() for block in order[1:]}
+        start = len(self.program.instrs)
+        self.i(label("_start" if self.func.name == "_main" else f"_{self.func.name}"))
+        self.i(push(r.ebp))
+        self.i(mov(r.ebp, r.esp))
+        frame = len(self.program.instrs)
+        self.i(sub(r.esp, imm(0)))
+        for value, reg in zip(self.func.params, ARG_REGISTERS):
+            if self.func.defs[value] is not None:
+                self.i(mov(self.slot(value), reg))
+        for index, block in enumerate(order):
+            if block.id in self.labels:
+                self.i(self.labels[block.id])
+            for phi in block.phis:
+                self.i(mov(r.eax, self.shadow(phi)))
+                self.i(mov(self.slot(phi.dest), r.eax))
+            for instr in block.instrs:
+                if instr.op == "br" or instr.op == "jmp":
+                    self.copies(block)
+                getattr(self, "select_" + instr.op)(instr, order[index + 1] if index + 1 < len(order) else None)
+        self.program.instrs[frame] = sub(r.esp, imm(self.frame))
+        return self.program.instrs[start:]
+
+    def copies(self, block):
+        # feed the phis of the successors through their shadow slots
+        for succ in block.succs:
+            index = succ.preds.index(block)
+            for phi in succ.phis:
+                src = self.operand(phi.args[index])
+                if isinstance(src, Memory):
+                    self.i(mov(r.eax, src))
+                    src = r.eax
+                self.i(mov(self.shadow(phi), src))
+
+    def store(self, instr, reg=r.eax):
+        self.i(mov(self.slot(instr.dest), reg))
+
+    def select_const(self, instr, next):
+        pass
+
+    def select_param(self, instr, next):
+        pass
+
+    def select_add(self, instr, next):
+        self.load(r.eax, instr.args[0])
+        self.i(SIMPLE[instr.op](r.eax, self.operand(instr.args[1])))
+        self.store(instr)
+
+    select_sub = select_and = select_or = select_add
+
+    def select_mul(self, instr, next):
+        self.load(r.eax, instr.args[0])
+        src = self.operand(instr.args[1])
+        if isinstance(src, Immediate):
+            self.i(mov(r.ebx, src))
+            src = r.ebx
+        self.i(imul(r.eax, src))
+        self.store(instr)
+
+    def select_div(self, instr, next):
+        self.load(r.eax, instr.args[0])
+        self.load(r.ebx, instr.args[1])
+        self.i(mov(r.edx, imm(0)))
+        self.i(idiv(r.ebx))
+        self.store(instr, r.eax if instr.op == "div" else r.edx)
+
+    select_mod = select_div
+
+    def select_eq(self, instr, next):
+        self.load(r.ecx, instr.args[0])
+        self.i(cmp(r.ecx, self.operand(instr.args[1])))
+        self.i(SETCC[instr.op](r.al))
+        self.i(movzx(r.eax, r.al))
+        self.store(instr)
+
+    select_ne = select_lt = select_le = select_gt = select_ge = select_eq
+
+    def select_neg(self, instr, next):
+        self.load(r.eax, instr.args[0])
+        self.i(neg(r.eax))
+        self.store(instr)
+
+    def select_not(self, instr, next):
+        self.load(r.eax, instr.args[0])
+        self.i(cmp(r.eax, imm(0)))
+        self.i(sete(r.al))
+        self.i(movzx(r.eax, r.al))
+        self.store(instr)
+
+    def select_call(self, instr, next):
+        registers, stack = instr.args[:len(ARG_REGISTERS)], instr.args[len(ARG_REGISTERS):]
+        for arg in reversed(stack):
+            self.i(push(self.operand(arg)))
+        for reg, arg in zip(ARG_REGISTERS, registers):
+            self.load(reg, arg)
+        self.i(call(f"_{instr.extra}", len(registers)))
+        if stack:
+            self.i(add(r.esp, imm(4 * len(stack))))
+        if instr.dest is not None:
+            self.store(instr)
+
+    def select_lire(self, instr, next):
+        self.i(mov(r.eax, Global("sinput")))
+        self.i(call("readline"))
+        self.i(call("atoi"))
+        self.store(instr)
+
+    def select_ecrire(self, instr, next):
+        self.load(r.eax, instr.args[0])
+        self.i(call("iprintLF"))
+
+    def select_jmp(self, instr, next):
+        if instr.extra[0] is not next:
+            self.i(jmp(self.labels[instr.extra[0].id]))
+
+    def select_br(self, instr, next):
+        then, orelse = instr.extra
+        self.load(r.eax, instr.args[0])
+        self.i(cmp(r.eax, imm(0)))
+        if then is next:
+            self.i(je(self.labels[orelse.id]))
+        else:
+            self.i(jne(self.labels[then.id]))
+            if orelse is not next:
+                self.i(jmp(self.labels[orelse.id]))
+
+    def select_ret(self, instr, next):
+        if instr.args:
+            self.load(r.eax, instr.args[0])
+        self.i(mov(r.esp, r.ebp))
+        self.i(pop(r.ebp))
+        self.i(ret())
+
+    def select_exit(self, instr, next):
+        self.i(mov(r.eax, imm(1)))
+        self.i(mov(r.ebx, imm(0)))
+        self.i(int_(0x80))
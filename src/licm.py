@@ -0,0 +1,97 @@
+# coding: utf-8
+from lark import Token, Tree
+
+from src.analyzer import Type
+from src.purity import IO_BUILTINS, pure_functions, safe_division, safe_functions
+from src.x86 import Memory, r
+
+HOISTABLE = {"expr_add", "expr_mult", "expr_rel", "expr_unaire", "expr_non", "expr_ou", "expr_et", "appel"}
+
+
+def written(tree, names=None):
+    # variables assigned or declared, and functions declared, anywhere in tree
+    names = set() if names is None else names
+    if isinstance(tree, Tree):
+        if tree.data == "affectation":
+            names.add(tree.children[0].value)
+        elif tree.data in ("decl", "fonction"):
+            names.add(tree.children[1].value)
+        for child in tree.children:
+            written(child, names)
+    return names
+
+
+def mentions_variable(tree):
+    return any(isinstance(t, Token) and t.type == "NOM" for t in tree.scan_values(lambda _: True)) \
+        or any(sub.data == "appel" for sub in tree.iter_subtrees())
+
+
+class Hoister:
+    def __init__(self, prog):
+        pure, infos, objects = pure_functions(prog)
+        self.pure = {objects[key].name for key in pure}
+        self.safe = {objects[key].name for key in safe_functions(pure, infos)}
+        self.seen = set()
+        self.hoisted = 0
+
+    def invariant(self, tree, variant, evaluated):
+        # evaluated: tree runs on every entry of the loop, so computing it early cannot add a trap
+        if isinstance(tree, Token):
+            return tree.type != "NOM" or tree.value not in variant
+        if tree.data == "appel":
+            name, args = tree.children
+            if name.value in IO_BUILTINS or name.value in variant \
+                    or name.value not in (self.pure if evaluated else self.safe):
+                return False
+            return not args or all(self.invariant(arg, variant, evaluated) for arg in args.children)
+        if tree.data == "expr_mult" and not evaluated and not safe_division(tree):
+            return False
+        return all(self.invariant(child, variant, evaluated) for child in tree.children)
+
+    def collect(self, tree, variant, evaluated, out):
+        if isinstance(tree, Token) or tree.data == "fonction" or id(tree) in self.seen:
+            return
+        if tree.data in HOISTABLE and tree.type != Type.VOID and mentions_variable(tree) \
+                and self.invariant(tree, variant, evaluated):
+            out.append(tree)
+            return
+        for child in tree.children:
+            if child is not None:
+                self.collect(child, variant, evaluated, out)
+
+    def loop(self, tantque, frame):
+        cond, body = tantque.children
+        variant = written(body)
+        found = []
+        self.collect(cond, variant, True, found)
+        self.collect(body, variant, False, found)
+        self.seen.update(map(id, found))
+        tantque.invariants = [(expr, frame.slot()) for expr in found]
+        self.hoisted += len(found)
+
+    def visit(self, tree, frame):
+        if not isinstance(tree, Tree):
+            return
+        if tree.data == "fonction":
+            frame = Frame(tree.func_obj, tree.body_scope.offset)
+        elif tree.data == "tantque":
+            self.loop(tree, frame)
+        for child in tree.children:
+            self.visit(child, frame)
+
+
+class Frame:
+    def __init__(self, func, base):
+        self.func = func
+        self.base = base
+
+    def slot(self):
+        # one more local below the ones the analyzer laid out
+        self.func.stack_size += 4
+        return Memory(r.ebp, -(self.func.stack_size - self.base))
+
+
+def hoist_invariants(prog):
+    hoister = Hoister(prog)
+    hoister.visit(prog, Frame(prog.scope.parent_function, 0))
+    return hoister.hoisted
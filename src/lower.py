@@ -0,0 +1,287 @@
+# coding: utf-8
+from lark import Token
+
+from src.analyzer import Type
+from src.ir import Function, Instr, Module
+from src.purity import owner, pure_functions, safe_functions
+
+BINARY_OPS = {
+    "+": "add", "-": "sub", "*": "mul", "/": "div", "%": "mod",
+    "==": "eq", "!=": "ne", "<": "lt", "<=": "le", ">": "gt", ">=": "ge",
+}
+
+
+def lower(prog):
+    # analyzed AST -> SSA, one Function per fonction plus _main for the top-level statements
+    module = Module()
+    pure, infos, objects = pure_functions(prog)
+    module.removable_calls = {objects[key].name for key in safe_functions(pure, infos)}
+    stmts, _ = prog.code
+    for func in all_functions(prog):
+        obj = func.func_obj
+        lowering = Lowering(obj.name, obj.return_type, func.body_scope)
+        module.functions[obj.name] = lowering.function(obj, func.children[3])
+    main = prog.scope.parent_function
+    module.functions[main.name] = Lowering(main.name, Type.VOID, prog.scope).main(stmts)
+    return module
+
+
+def all_functions(tree):
+    # fonction can be declared in any bloc, including nested ones
+    return [sub for sub in tree.iter_subtrees_topdown() if sub.data == "fonction"]
+
+
+class Lowering:
+    # SSA construction on the fly (Braun et al., "Simple and Efficient Construction of SSA Form")
+    def __init__(self, name, return_type, scope):
+        self.func = Function(name, return_type, [])
+        self.defs: dict[tuple, dict] = {}
+        self.sealed = set()
+        self.incomplete: dict[int, list] = {}
+        self.aliases: dict[int, int] = {}
+        self.types: dict[tuple, Type] = {}
+        self.scope = scope
+        self.block = self.func.new_block()
+        self.seal(self.block)
+
+    def function(self, obj, body):
+        for index, (name, type) in enumerate(obj.args):
+            value = self.func.emit(self.block, "param", type, extra=index).dest
+            self.func.params.append(value)
+            self.write(self.key(name), self.block, value)
+        self.bloc(body)
+        if self.block.term is None:
+            self.func.emit(self.block, "ret", None)
+        return self.finish()
+
+    def main(self, stmts):
+        for stmt in stmts:
+            self.stmt(stmt)
+        if self.block.term is None:
+            self.func.emit(self.block, "exit", None)
+        return self.finish()
+
+    def finish(self):
+        # removing a trivial phi can make the phis using it trivial
+        changed = True
+        while changed:
+            changed = False
+            for block in self.func.blocks:
+                for phi in block.phis:
+                    if phi.dest not in self.aliases and self.trivial(phi) != phi.dest:
+                        changed = True
+        self.func.replace_uses(self.aliases)
+        for block in self.func.blocks:
+            block.phis = [phi for phi in block.phis if phi.dest not in self.aliases]
+        for value in self.aliases:
+            self.func.defs[value] = None
+        return self.func
+
+    # variables
+
+    def key(self, name):
+        return id(owner(self.scope, name)), name
+
+    def write(self, key, block, value):
+        self.defs.setdefault(key, {})[block.id] = value
+        self.types.setdefault(key, self.func.types[value])
+
+    def read(self, key, block):
+        value = self.defs.get(key, {}).get(block.id)
+        if value is None:
+            value = self.read_recursive(key, block)
+        while value in self.aliases:
+            value = self.aliases[value]
+        return value
+
+    def read_recursive(self, key, block):
+        if block.id not in self.sealed:
+            phi = self.phi(block, key)
+            self.incomplete.setdefault(block.id, []).append((key, phi))
+            value = phi.dest
+        elif len(block.preds) == 1:
+            value = self.read(key, block.preds[0])
+        elif not block.preds:
+            # read before any assignment (or from an enclosing function): Flo zero-initializes
+            value = self.func.emit(self.func.entry, "const", Type.INTEGER, extra=0).dest
+            self.func.entry.instrs.insert(0, self.func.entry.instrs.pop())
+        else:
+            phi = self.phi(block, key)
+            self.write(key, block, phi.dest)
+            value = self.operands(key, phi)
+        self.write(key, block, value)
+        return value
+
+    def phi(self, block, key):
+        instr = Instr("phi")
+        self.func.new_value(self.types.get(key, Type.INTEGER), instr)
+        return block.append(instr)
+
+    def operands(self, key, phi):
+        phi.args = [self.read(key, pred) for pred in phi.block.preds]
+        return self.trivial(phi)
+
+    def trivial(self, phi):
+        same = None
+        for arg in phi.args:
+            while arg in self.aliases:
+                arg = self.aliases[arg]
+            if arg == same or arg == phi.dest:
+                continue
+            if same is not None:
+                return phi.dest
+            same = arg
+        if same is None:
+            return phi.dest
+        self.aliases[phi.dest] = same
+        return same
+
+    def seal(self, block):
+        for key, phi in self.incomplete.pop(block.id, []):
+            self.operands(key, phi)
+        self.sealed.add(block.id)
+
+    # control flow
+
+    def new_block(self, *preds):
+        block = self.func.new_block()
+        for pred in preds:
+            self.func.link(pred, block)
+        return block
+
+    def jump(self, target):
+        if self.block.term is None:
+            self.func.emit(self.block, "jmp", None, extra=(target,))
+            self.func.link(self.block, target)
+
+    def branch(self, cond, then, orelse):
+        self.func.emit(self.block, "br", None, [cond], (then, orelse))
+        self.func.link(self.block, then)
+        self.func.link(self.block, orelse)
+
+    # statements
+
+    def bloc(self, block):
+        outer, self.scope = self.scope, block.scope
+        for stmt in block.children:
+            if stmt.data != "fonction":
+                self.stmt(stmt)
+        self.scope = outer
+
+    def stmt(self, tree):
+        if self.block.term is not None:
+            # dead code after retourner: lower it in a block nothing jumps to
+            self.block = self.func.new_block()
+            self.seal(self.block)
+        getattr(self, "stmt_" + tree.data)(tree)
+
+    def stmt_decl(self, decl):
+        _, name, val = decl.children
+        value = self.expr(val) if val is not None else self.const(0)
+        self.write((id(self.scope), name.value), self.block, value)
+
+    def stmt_affectation(self, affectation):
+        var, val = affectation.children
+        value = self.expr(val)
+        self.write(self.key(var.value), self.block, value)
+
+    def stmt_expr_instr(self, expr):
+        self.expr(expr.children[0])
+
+    def stmt_retourner(self, ret):
+        value = self.expr(ret.children[0])
+        self.func.emit(self.block, "ret", None, [value])
+
+    def stmt_si(self, si):
+        cond, if_block, *else_block = si.children
+        value = self.expr(cond)
+        then = self.new_block()
+        orelse = self.new_block()
+        self.branch(value, then, orelse)
+        self.seal(then)
+        self.seal(orelse)
+        self.block = then
+        self.bloc(if_block)
+        then_end = self.block
+        self.block = orelse
+        if else_block:
+            if else_block[0].data == "si":
+                self.stmt(else_block[0])
+            else:
+                self.bloc(else_block[0])
+        else_end = self.block
+        end = self.func.new_block()
+        for pred in (then_end, else_end):
+            self.block = pred
+            self.jump(end)
+        self.seal(end)
+        self.block = end
+
+    def stmt_tantque(self, tantque):
+        # rotated like the stack compiler: cond; br body, end; body: ...; cond; br body, end
+        cond, block = tantque.children
+        value = self.expr(cond)
+        body = self.new_block()
+        end = self.new_block()
+        self.branch(value, body, end)
+        self.block = body
+        self.bloc(block)
+        if self.block.term is None:
+            value = self.expr(cond)
+            self.branch(value, body, end)
+        self.seal(body)
+        self.seal(end)
+        self.block = end
+
+    # expressions
+
+    def const(self, value, type=Type.INTEGER):
+        return self.func.emit(self.block, "const", type, extra=value).dest
+
+    def expr(self, tree):
+        if isinstance(tree, Token):
+            if tree.type == "ENTIER":
+                return self.const(int(tree.value))
+            if tree.type == "BOOLEEN":
+                return self.const(1 if tree.value == "Vrai" else 0, Type.BOOLEAN)
+            return self.read(self.key(tree.value), self.block)
+        return getattr(self, "expr_" + tree.data)(tree)
+
+    def binary(self, op, lhs, rhs, type):
+        return self.func.emit(self.block, op, type, [self.expr(lhs), self.expr(rhs)]).dest
+
+    def expr_expr_add(self, expr):
+        lhs, op, rhs = expr.children
+        return self.binary(BINARY_OPS[op], lhs, rhs, Type.INTEGER)
+
+    expr_expr_mult = expr_expr_add
+
+    def expr_expr_rel(self, expr):
+        lhs, op, rhs = expr.children
+        return self.binary(BINARY_OPS[op], lhs, rhs, Type.BOOLEAN)
+
+    def expr_expr_ou(self, expr):
+        return self.binary("or", *expr.children, Type.BOOLEAN)
+
+    def expr_expr_et(self, expr):
+        return self.binary("and", *expr.children, Type.BOOLEAN)
+
+    def expr_expr_unaire(self, expr):
+        _, val = expr.children
+        return self.func.emit(self.block, "neg", Type.INTEGER, [self.expr(val)]).dest
+
+    def expr_expr_non(self, expr):
+        return self.func.emit(self.block, "not", Type.BOOLEAN, [self.expr(expr.children[1])]).dest
+
+    def expr_appel(self, appel):
+        name, args = appel.children
+        # right to left, like the stack compiler pushes them
+        values = [self.expr(arg) for arg in reversed(args.children)][::-1] if args else []
+        if name.value == "lire":
+            return self.func.emit(self.block, "lire", Type.INTEGER).dest
+        if name.value == "ecrire":
+            self.func.emit(self.block, "ecrire", None, values)
+            return None
+        func = self.scope.get_function(name.value)
+        type = func.return_type if func.return_type != Type.VOID else None
+        return self.func.emit(self.block, "call", type, values, name.value).dest
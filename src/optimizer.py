@@ -4,14 +4,21 @@ from __future__ import annotations
 import dataclasses
 import inspect
 import sys
+from collections import Counter
+from functools import cache
+from itertools import accumulate, takewhile
 from types import UnionType
 from typing import get_type_hints
 
+from src.cfg import CFG, ends_block
 from src.compiler import Program
+from src.peephole import RuleSet, operand_names
 from src.x86 import *
 
+verbose = True
+
 py_print = print
-print = lambda *args: py_print(inspect.stack()[1].function, ":", *args, file=sys.stderr)
+print = lambda *args: verbose and py_print(inspect.stack()[1].function, ":", *args, file=sys.stderr)
 
 
 def type_in(needle, haystack):
@@ -21,12 +28,18 @@ def type_in(needle, haystack):
 
 
 def optimize(prog: Program):
+    before = prog.cost() if verbose else None
     pass_count = 0
     while any(pass_(prog) for pass_ in passes):
         pass_count += 1
         if pass_count % 1000 == 0:
             print("Warning:", pass_count, "passes have been run, this may be an infinite loop")
     print("Optimization finished after", pass_count, "passes")
+    if verbose:
+        after = prog.cost()
+        print(f"Estimated cost: {before.cycles} → {after.cycles} cycles, {before.size} → {after.size} bytes")
+    print(f"Peephole matcher: {rules.scanned} instructions in {rules.elapsed:.4f}s "
+          f"({rules.throughput():.0f} instructions/s)")
 
 
 passes = []
@@ -37,25 +50,64 @@ def register_pass(pass_):
     return pass_
 
 
+def lowers_cost(old, new):
+    # the cost model decides: fewer estimated cycles, then fewer uops, then fewer bytes
+    return block_cost(new).key() < block_cost(old).key()
+
+
+rules = RuleSet(accept=lowers_cost)
+rules.add("push $x; pop $y => mov $y, $x", where=lambda x, y: not (isinstance(x, Memory) and isinstance(y, Memory)))
+rules.add("mov $x, $x =>")
+rules.add("jmp $l; $l: => $l:")
+rules.add("je $l; $l: => $l:")
+rules.add("jne $l; $l: => $l:")
+rules.add("je $a; jmp $b; $a: => jne $b; $a:")
+rules.add("jne $a; jmp $b; $a: => je $b; $a:")
+rules.add("mov esp, ebp; pop ebp => leave")
+rules.add("add $x, 0 =>")
+rules.add("sub $x, 0 =>")
+rules.add("mov $a, $b; $op $c, $a => mov $a, $b; $op $c, $b",
+          where=lambda a, b, op: a != b and isinstance(b, (Register, Immediate))
+                                 and operand_names(op) == ("dst", "src") and accepts(op, "src", b))
+rules.add("mov $a, $b; $op $a => mov $a, $b; $op $b",
+          where=lambda a, b, op: a != b and isinstance(b, (Register, Immediate))
+                                 and operand_names(op) == ("src",) and accepts(op, "src", b))
+
+rules.add("mov $a, $b; $op $a, $c; mov $b, $a => $op $b, $c; mov $a, $b",
+          where=lambda a, b, c, op: isinstance(a, Register) and isinstance(b, Register) and a != b and c != a
+                                    and op in (add, sub, and_, or_, imul))
+
+
 @register_pass
-def push_then_pop(prog: Program):
-    found = False
-    for i, (a, b) in enumerate(zip(prog.instrs, prog.instrs[1:])):
-        if isinstance(a, push) and isinstance(b, pop):
-            print(f"{a}; {b} => {mov(b.dst, a.src)}")
-            prog.instrs[i:i + 2] = [mov(b.dst, a.src), nop()]
-            found = True
-    return found
+def peephole(prog: Program):
+    rewrites = rules.apply(prog.instrs)
+    for old, new in rewrites:
+        print(f"{'; '.join(map(str, old))} => {'; '.join(map(str, new)) or 'nop'}")
+    return bool(rewrites)
 
 
 @register_pass
-def redundant_mov(prog: Program):
+def forward_pushes(prog: Program):
+    # push x; ...; pop y => mov y, x; ... when nothing in between uses y or the stack, and the cost model agrees
     found = False
-    for i, a in enumerate(prog.instrs):
-        if isinstance(a, mov) and a.src == a.dst:
-            print(f"{a} => nop")
-            prog.instrs[i] = nop()
-            found = True
+    instrs = prog.instrs
+    for i, instr in enumerate(instrs):
+        if not isinstance(instr, push):
+            continue
+        used = set()
+        for j in range(i + 1, len(instrs)):
+            other = instrs[j]
+            if isinstance(other, pop):
+                new = [mov(other.dst, instr.src)] + instrs[i + 1:j]
+                # the nop left in place of the pop goes away in remove_nops
+                if isinstance(other.dst, Register) and other.dst not in used and lowers_cost(instrs[i:j + 1], new):
+                    print(f"{instr}; ...; {other} => {new[0]}")
+                    instrs[i:j + 1] = new + [nop()]
+                    found = True
+                break
+            used |= other.reads() | other.writes()
+            if isinstance(other, (label, AltersFlow)) or ends_block(other) or r.esp in used:
+                break
     return found
 
 
@@ -66,21 +118,10 @@ def remove_nops(prog: Program):
     return len(prog.instrs) != len(old_instrs)
 
 
-@register_pass
-def jump_right_after(prog: Program):
-    found = False
-    for i, (a, b) in enumerate(zip(prog.instrs, prog.instrs[1:])):
-        if isinstance(a, jmp) and isinstance(b, label) and a.dst == b:
-            print(f"{a}; {b} => nop; {b}")
-            prog.instrs[i] = nop()
-            found = True
-    return found
-
-
 @register_pass
 def unused_label(prog: Program):
-    labels = prog.labels.copy()
-    labels.pop("_start", None)
+    # _start and function entries can be reached from outside prog
+    labels = {name: instr for name, instr in prog.labels.items() if not name.startswith("_")}
     for instr in prog.instrs:
         if not isinstance(instr, label):
             for v in instr.__dict__.values():
@@ -117,38 +158,77 @@ def label_right_after(prog: Program):
     return found
 
 
-@register_pass
-def mov_pop_to_leave(prog: Program):
-    found = False
-    for i, (a, b) in enumerate(zip(prog.instrs, prog.instrs[1:])):
-        if a == mov(r.esp, r.ebp) and b == pop(r.ebp):
-            print(f"{a}; {b} => leave")
-            prog.instrs[i:i + 2] = [leave(), nop()]
-            found = True
-    return found
+def fresh_label(prog: Program):
+    prog.label_count += 1
+    prog.labels[name] = res = label(name := f"l{prog.label_count}")
+    return res
+
+
+def landing(instrs, positions, target):
+    # first real instruction executed after jumping to target
+    i = positions[target.name]
+    while isinstance(instrs[i], (label, align)):
+        i += 1
+    return i
 
 
 @register_pass
-def zero_add_sub(prog: Program):
+def thread_jumps(prog: Program):
+    # jmp/je/jne to a jump: go straight to where that jump ends up
     found = False
-    for i, instr in enumerate(prog.instrs):
-        if isinstance(instr, (add, sub)) and instr.src == imm(0):
-            print(f"{instr} => nop")
-            prog.instrs[i] = nop()
+    instrs = prog.instrs
+    positions = {instr.name: i for i, instr in enumerate(instrs) if isinstance(instr, label)}
+    for i, instr in enumerate(instrs):
+        if not isinstance(instr, (jmp, je, jne)):
+            continue
+        target, seen = instr.dst, {instr.dst.name}
+        while (j := landing(instrs, positions, target)) < len(instrs):
+            hop = instrs[j]
+            if isinstance(hop, jmp) or type(hop) is type(instr):
+                # the flags are the same ones: a same-condition jump is taken again
+                target = hop.dst
+            elif isinstance(hop, (je, jne)) and not isinstance(instr, jmp):
+                # opposite condition: never taken, fall through it
+                if j + 1 < len(instrs) and isinstance(instrs[j + 1], label):
+                    target = instrs[j + 1]
+                else:
+                    instrs.insert(j + 1, fresh_label(prog))
+                    return True
+            else:
+                break
+            if target.name in seen:
+                # jump cycle: leave it alone
+                target = instr.dst
+                break
+            seen.add(target.name)
+        if target != instr.dst:
+            print(f"{instr} => {target.name}")
+            instrs[i] = dataclasses.replace(instr, dst=target)
             found = True
     return found
 
 
 @register_pass
-def move_ab_ba(prog: Program):
+def unreachable_code(prog: Program):
+    # entries are the first block, called or _ labels and whatever follows int 0x80
+    cfg = CFG(prog.instrs)
+    called = {instr.dst for instr in prog.instrs if isinstance(instr, call)}
+    todo = [block for k, block in enumerate(cfg.blocks)
+            if k == 0 or block.label and (block.label.name.startswith("_") or block.label.name in called)
+            or k and isinstance(prog.instrs[cfg.blocks[k - 1].end - 1], int_)]
+    reached = set()
+    while todo:
+        if (block := todo.pop()) not in reached:
+            reached.add(block)
+            todo.extend(block.succs)
     found = False
-    for i, (a, b) in enumerate(zip(prog.instrs, prog.instrs[1:])):
-        if isinstance(a, mov) and hasattr(b, "src") and a.dst == b.src and isinstance(a.src, (Register, Immediate)):
-            src_type = get_type_hints(type(b))["src"]
-            if type_in(a.src, src_type):
-                new_instr = dataclasses.replace(b, src=a.src)
-                print(f"{a}; {b} => {a}; {new_instr}")
-                prog.instrs[i + 1] = new_instr
+    for block in cfg.blocks:
+        if block in reached:
+            continue
+        for i in block.indices():
+            if not isinstance(prog.instrs[i], (label, align, nop)):
+                print(f"unreachable {prog.instrs[i]}")
+                prog.instrs[i] = nop()
                 found = True
     return found
 
@@ -161,12 +241,424 @@ def move_dead_writes(prog: Program):
         if isinstance(instr, (AltersFlow)):
             write_targets.clear()
             continue
+        for src in instr.reads():
+            write_targets.pop(src, None)
         if isinstance(instr, mov):
-            if write_i := write_targets.get(instr.dst, None):
+            dst = instr.dst.full if isinstance(instr.dst, Register) else instr.dst
+            if write_i := write_targets.get(dst, None):
                 print(f"deleting dead {prog.instrs[write_i]}" + (" (replaced by " + str(instr) + ")"))
                 prog.instrs[write_i] = nop()
                 found = True
-            write_targets[instr.dst] = i
-        if (src := getattr(instr, "src", None)) in write_targets:
-            write_targets.pop(src, None)
+            write_targets[dst] = i
+    return found
+
+
+@cache
+def operand_types(cls):
+    return get_type_hints(cls)
+
+
+def accepts(cls, field_name, value):
+    return field_name in (hints := operand_types(cls)) and type_in(value, hints[field_name])
+
+
+def tracked_slot(op):
+    return isinstance(op, Memory) and op.base == r.ebp and op.index_scale is None
+
+
+def wrap(value):
+    value &= 0xFFFFFFFF
+    return value - (1 << 32) if value & 0x80000000 else value
+
+
+FOLD = {
+    "add": lambda a, b: a + b,
+    "sub": lambda a, b: a - b,
+    "and_": lambda a, b: a & b,
+    "or_": lambda a, b: a | b,
+    "imul": lambda a, b: a * b,
+}
+COMMUTATIVE = {"add", "and_", "or_", "imul"}
+CONDITIONS = {
+    "sete": lambda a, b: a == b,
+    "setne": lambda a, b: a != b,
+    "setl": lambda a, b: a < b,
+    "setle": lambda a, b: a <= b,
+    "setg": lambda a, b: a > b,
+    "setge": lambda a, b: a >= b,
+}
+
+
+class ValueNumbering:
+    def __init__(self):
+        self.table = {}
+        self.keys = []
+        self.consts = {}
+        self.locs = {}
+        self.stack = []
+        self.depth = None  # esp - ebp, while it is known
+
+    def number(self, key, const=None):
+        if (vn := self.table.get(key)) is None:
+            vn = self.table[key] = len(self.keys)
+            self.keys.append(key)
+            if const is not None:
+                self.consts[vn] = const
+        return vn
+
+    def fresh(self):
+        return self.number(("fresh", len(self.keys)))
+
+    def constant(self, value):
+        value = wrap(value)
+        return self.number(("imm", value), value)
+
+    def get(self, loc):
+        if (vn := self.locs.get(loc)) is None:
+            vn = self.locs[loc] = self.fresh()
+        return vn
+
+    def value(self, op):
+        if isinstance(op, imm):
+            return self.constant(int(op.value))
+        if isinstance(op, Global):
+            return self.number(("global", op.name))
+        if isinstance(op, Register):
+            full = self.get(op.full)
+            if op.is_byte:
+                key = self.keys[full]
+                if key[0] == "setlow":
+                    return key[2]
+                if (c := self.consts.get(full)) is not None:
+                    return self.constant(c & 0xFF)
+                return self.number(("low8", full))
+            return full
+        if tracked_slot(op):
+            return self.get(op)
+        return self.fresh()
+
+    def holder(self, vn):
+        for loc, held in self.locs.items():
+            if held == vn and isinstance(loc, Register) and loc in GENERAL_REGISTERS:
+                return loc
+        return None
+
+    def assign(self, dst, vn):
+        if isinstance(dst, Register):
+            if dst.is_byte:
+                vn = self.number(("setlow", self.get(dst.full), vn))
+            self.locs[dst.full] = vn
+        elif tracked_slot(dst):
+            self.forget_memory(dst)
+            self.locs[dst] = vn
+        else:
+            self.forget_memory()
+
+    def forget_memory(self, near: Memory = None):
+        for loc in list(self.locs):
+            if isinstance(loc, Memory) and (near is None or abs(loc.offset - near.offset) < 4):
+                del self.locs[loc]
+
+    def clobber(self, instr):
+        for loc in instr.writes():
+            if loc == r.esp:
+                if not isinstance(instr, (push, pop)):
+                    self.stack.clear()
+                    self.depth = None
+            elif loc == r.ebp:
+                self.forget_memory()
+                self.locs.pop(r.ebp, None)
+            elif isinstance(loc, Memory):
+                self.assign(loc, self.fresh())
+            else:
+                self.locs[loc] = self.fresh()
+
+    def better(self, instr, field_name, op, vn):
+        if (c := self.consts.get(vn)) is not None and not isinstance(op, Immediate):
+            if accepts(type(instr), field_name, imm(c)):
+                return imm(c)
+        if isinstance(op, Memory) and (reg := self.holder(vn)):
+            return reg
+        return op
+
+    def with_src(self, instr, vn):
+        new_src = self.better(instr, "src", instr.src, vn)
+        if new_src != instr.src:
+            return dataclasses.replace(instr, src=new_src)
+        return instr
+
+    def materialize(self, dst, vn):
+        if (c := self.consts.get(vn)) is not None:
+            return mov(dst, imm(c))
+        if reg := self.holder(vn):
+            return mov(dst, reg)
+        return None
+
+    def visit(self, instr, flags_dead):
+        name = type(instr).__name__
+        if isinstance(instr, mov):
+            vn = self.value(instr.src)
+            if self.locs.get(instr.dst.full if isinstance(instr.dst, Register) else instr.dst) == vn \
+                    and not (isinstance(instr.dst, Register) and instr.dst.is_byte):
+                return nop()
+            instr = self.with_src(instr, vn)
+            self.assign(instr.dst, vn)
+            if instr.dst == r.esp:
+                self.depth = None
+            elif instr == mov(r.ebp, r.esp):
+                self.depth = 0
+        elif isinstance(instr, push):
+            vn = self.value(instr.src)
+            instr = self.with_src(instr, vn)
+            self.stack.append(vn)
+            if self.depth is not None:
+                # a push below the frame pointer is a store to a frame slot
+                self.depth -= 4
+                self.assign(Memory(r.ebp, self.depth), vn)
+        elif isinstance(instr, pop):
+            vn = self.stack.pop() if self.stack else self.fresh()
+            self.assign(instr.dst, vn)
+            if self.depth is not None:
+                self.forget_memory(Memory(r.ebp, self.depth))
+                self.depth += 4
+        elif name in ("add", "sub") and instr.dst == r.esp:
+            if self.depth is not None and isinstance(instr.src, imm):
+                self.depth += instr.src.value if name == "add" else -instr.src.value
+            else:
+                self.depth = None
+            self.stack.clear()
+            self.locs[r.esp] = self.fresh()
+            self.locs[FLAGS] = self.fresh()
+        elif name in FOLD and isinstance(instr.dst, Register) and not instr.dst.is_byte:
+            a, b = self.value(instr.dst), self.value(instr.src)
+            if name in COMMUTATIVE and b < a:
+                key = (name, b, a)
+            else:
+                key = (name, a, b)
+            if (ca := self.consts.get(a)) is not None and (cb := self.consts.get(b)) is not None:
+                vn = self.constant(FOLD[name](ca, cb))
+            elif name in ("add", "sub", "or_") and self.consts.get(b) == 0:
+                vn = a
+            else:
+                vn = self.number(key)
+            if flags_dead:
+                if self.locs.get(instr.dst) == vn:
+                    return nop()
+                if new := self.materialize(instr.dst, vn):
+                    self.locs[instr.dst] = vn
+                    return new
+            instr = self.with_src(instr, b)
+            self.locs[instr.dst] = vn
+            self.locs[FLAGS] = self.number(("flags", key))
+        elif isinstance(instr, cmp):
+            a, b = self.value(instr.dst), self.value(instr.src)
+            ca, cb = self.consts.get(a), self.consts.get(b)
+            flags = self.number(("cmp", a, b), (ca, cb) if ca is not None and cb is not None else None)
+            if self.locs.get(FLAGS) == flags:
+                return nop()
+            instr = self.with_src(instr, b)
+            self.locs[FLAGS] = flags
+        elif name in CONDITIONS:
+            flags = self.get(FLAGS)
+            if (pair := self.consts.get(flags)) is not None:
+                vn = self.constant(int(CONDITIONS[name](*pair)))
+                instr = mov(instr.dst, imm(self.consts[vn]))
+            else:
+                vn = self.number((name, flags))
+            self.assign(instr.dst, vn)
+        elif isinstance(instr, (je, jne)):
+            if (pair := self.consts.get(self.get(FLAGS))) is not None:
+                # outcome known: either always taken or never
+                return jmp(instr.dst) if (pair[0] == pair[1]) == isinstance(instr, je) else nop()
+        elif isinstance(instr, movzx):
+            vn = self.value(instr.src)
+            if self.locs.get(instr.dst) == vn:
+                return nop()
+            if new := self.materialize(instr.dst, vn):
+                instr = new
+            self.assign(instr.dst, vn)
+        elif isinstance(instr, neg) and isinstance(instr.dst, Register):
+            a = self.value(instr.dst)
+            if (c := self.consts.get(a)) is not None:
+                vn = self.constant(-c)
+                if flags_dead:
+                    self.locs[instr.dst] = vn
+                    return mov(instr.dst, imm(self.consts[vn]))
+            else:
+                vn = self.number(("neg", a))
+            self.locs[instr.dst] = vn
+            self.locs[FLAGS] = self.number(("flags", ("neg", a)))
+        else:
+            self.clobber(instr)
+        return instr
+
+
+def flags_dead_after(cfg: CFG):
+    return [FLAGS not in live for live in cfg.live_after(cfg.liveness())]
+
+
+@register_pass
+def local_value_numbering(prog: Program):
+    found = False
+    cfg = CFG(prog.instrs)
+    dead = flags_dead_after(cfg)
+    for block in cfg.blocks:
+        numbering = ValueNumbering()
+        for i in block.indices():
+            old = prog.instrs[i]
+            new = numbering.visit(old, dead[i])
+            if new != old:
+                print(f"{old} => {new}")
+                prog.instrs[i] = new
+                found = True
+    return found
+
+
+def copy_facts(instr, facts):
+    writes = {loc for loc in instr.writes() if isinstance(loc, Register)}
+    if writes:
+        facts = {(dst, src) for dst, src in facts if dst not in writes and src not in writes}
+    if isinstance(instr, mov) and isinstance(instr.dst, Register) and not instr.dst.is_byte \
+            and instr.dst not in (r.esp, r.ebp) and instr.dst != instr.src \
+            and (isinstance(instr.src, imm) or isinstance(instr.src, Register) and not instr.src.is_byte):
+        facts = facts | {(instr.dst, instr.src)}
+    return facts
+
+
+@register_pass
+def global_copy_propagation(prog: Program):
+    cfg = CFG(prog.instrs)
+    out = {block: None for block in cfg.blocks}
+    ins = {}
+    changed = True
+    while changed:
+        changed = False
+        for block in cfg.blocks:
+            preds = [out[pred] for pred in block.preds if out[pred] is not None]
+            facts = set() if block.entry else set.intersection(*preds) if preds else None
+            ins[block] = facts
+            if facts is None:
+                continue
+            for i in block.indices():
+                facts = copy_facts(prog.instrs[i], facts)
+            if facts != out[block]:
+                out[block] = facts
+                changed = True
+    found = False
+    for block in cfg.blocks:
+        if (facts := ins[block]) is None:
+            continue
+        for i in block.indices():
+            instr = prog.instrs[i]
+            src = getattr(instr, "src", None)
+            if isinstance(src, Register):
+                for dst, copy in facts:
+                    if dst == src and accepts(type(instr), "src", copy):
+                        new_instr = dataclasses.replace(instr, src=copy)
+                        print(f"{instr} => {new_instr}")
+                        prog.instrs[i] = instr = new_instr
+                        found = True
+                        break
+            facts = copy_facts(instr, facts)
+    return found
+
+
+@register_pass
+def dead_register_writes(prog: Program):
+    found = False
+    cfg = CFG(prog.instrs)
+    live_after = cfg.live_after(cfg.liveness())
+    for i, instr in enumerate(prog.instrs):
+        if isinstance(instr, (mov, movzx, cmp, add, sub, and_, or_, neg, imul, sete, setne, setl, setle, setg, setge)):
+            writes = instr.writes()
+            if all(isinstance(loc, (Register, str)) for loc in writes) and not writes & live_after[i]:
+                print(f"deleting dead {instr}")
+                prog.instrs[i] = nop()
+                found = True
+    return found
+
+
+def loop_depths(instrs):
+    # the compiler only emits structured loops: a backward jump closes one that starts at its target
+    labels = {instr.name: i for i, instr in enumerate(instrs) if isinstance(instr, label)}
+    delta = [0] * (len(instrs) + 1)
+    for i, instr in enumerate(instrs):
+        if isinstance(instr, (jmp, je, jne)) and (start := labels[instr.dst.name]) < i:
+            delta[start] += 1
+            delta[i + 1] -= 1
+    return list(accumulate(delta))
+
+
+def frames(instrs):
+    starts = [i for i, instr in enumerate(instrs[:-2])
+              if isinstance(instr, label) and instrs[i + 1] == push(r.ebp) and instrs[i + 2] == mov(r.ebp, r.esp)]
+    return list(zip(starts, starts[1:] + [len(instrs)]))
+
+
+def promoted(instrs, depths, profile=None, uses=None):
+    weights = Counter()
+    excluded = set()
+    for instr, depth in zip(instrs, depths):
+        for name, op in instr.__dict__.items():
+            if op in CALLEE_SAVED:
+                return None
+            if isinstance(op, Memory) and op.base == r.ebp:
+                if not tracked_slot(op):
+                    return None
+                if accepts(type(instr), name, CALLEE_SAVED[0]):
+                    weights[op] += 8 ** depth
+                else:
+                    excluded.add(op)
+    main = instrs[0].name == "_start"
+    # outside _start a register costs a save and a restore per call (and a load for a parameter):
+    # without a profile, only worth it for slots used in a loop
+    overhead = 8
+    if profile:
+        # measured uses and calls instead of the loop-depth guess; a save costs about two uses
+        weights = Counter({slot: uses[slot] for slot in weights})
+        overhead = 2 * profile[f"f:{instrs[0].name[1:]}"]
+    chosen = [slot for slot, weight in weights.most_common()
+              if slot not in excluded and weight > (0 if main else overhead * (2 + (slot.offset > 0)))]
+    chosen = chosen[:len(CALLEE_SAVED)]
+    if not chosen:
+        return None
+    regs = dict(zip(chosen, CALLEE_SAVED))
+    # outside _start the registers are saved right below ebp, which moves the rest of the frame down
+    saved = [] if main else list(regs.values())
+    shift = 4 * len(saved)
+    head = instrs[:3] + [push(reg) for reg in saved]
+    head += [mov(reg, slot) for slot, reg in regs.items() if slot.offset > 0]
+    # arguments passed in registers are spilled by the pushes right after the prologue: copy them instead
+    spills = list(takewhile(lambda k: instrs[3 + k] == push(ARG_REGISTERS[k]),
+                            range(min(len(ARG_REGISTERS), len(instrs) - 3))))
+    head += [mov(regs[slot], ARG_REGISTERS[k]) for k in spills if (slot := Memory(r.ebp, -4 * (k + 1))) in regs]
+    body = []
+    for instr in instrs[3:]:
+        if isinstance(instr, leave) or instr == mov(r.esp, r.ebp):
+            body += [mov(reg, Memory(r.ebp, -4 * k)) for k, reg in enumerate(saved, 1)]
+        changes = {}
+        for name, op in instr.__dict__.items():
+            if op in regs:
+                changes[name] = regs[op]
+            elif shift and isinstance(op, Memory) and op.base == r.ebp and op.offset < 0:
+                changes[name] = Memory(r.ebp, op.offset - shift)
+        body.append(dataclasses.replace(instr, **changes) if changes else instr)
+    if not lowers_cost(instrs, head + body):
+        return None
+    for slot, reg in regs.items():
+        print(f"{instrs[0].name}: {slot} => {reg}")
+    return head + body
+
+
+@register_pass
+def promote_locals(prog: Program):
+    # keep the hottest frame slots of each function in esi/edi: by profile counts when there is a profile,
+    # otherwise loop bodies weighing 8x per level
+    found = False
+    depths = loop_depths(prog.instrs)
+    for start, end in reversed(frames(prog.instrs)):
+        uses = prog.slot_uses.get(prog.instrs[start].name, Counter())
+        if new := promoted(prog.instrs[start:end], depths[start:end], prog.profile, uses):
+            prog.instrs[start:end] = new
+            found = True
     return found
@@ -0,0 +1,294 @@
+# coding: utf-8
+import operator
+
+from lark import Token, Tree
+
+from src.analyzer import Type
+from src.licm import written
+from src.purity import IO_BUILTINS, owner, pure_functions
+
+FUEL = 200_000  # evaluation steps for a whole program: bounds compile time
+MAX_OUTPUTS = 64  # ecrire calls a folded statement may leave behind
+MAX_DEPTH = 64  # nested fonction calls while evaluating
+
+RELATIONS = {
+    "==": operator.eq, "!=": operator.ne, "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge,
+}
+
+
+class Stuck(Exception):
+    # needs input, would trap, calls impure code or ran out of fuel: leave it to run time
+    pass
+
+
+class Return(Exception):
+    def __init__(self, value):
+        self.value = value
+
+
+def wrap(value):
+    value &= 0xFFFFFFFF
+    return value - (1 << 32) if value & 0x80000000 else value
+
+
+def divide(a, b):
+    # idiv with edx = 0: the dividend is read as unsigned, a quotient out of range traps
+    if b == 0:
+        raise Stuck
+    u = a & 0xFFFFFFFF
+    q = u // abs(b) * (1 if b > 0 else -1)
+    if not -(1 << 31) <= q < (1 << 31):
+        raise Stuck
+    return q, u % abs(b)
+
+
+def literal(value, type):
+    if type == Type.BOOLEAN:
+        return Token("BOOLEEN", "Vrai" if value else "Faux")
+    return Token("ENTIER", str(value))
+
+
+def ecrire(value):
+    appel = Tree("appel", [Token("NOM", "ecrire"), Tree("arguments", [Token("ENTIER", str(value))])])
+    appel.type = Type.VOID
+    stmt = Tree("expr_instr", [appel])
+    stmt.type = None
+    return stmt
+
+
+def visible(scope):
+    ids = set()
+    while scope is not None:
+        ids.add(id(scope))
+        scope = scope.parent
+    return ids
+
+
+class Evaluator:
+    def __init__(self, tree):
+        pure, infos, objects = pure_functions(tree)
+        self.functions = {key: infos[key].func for key in pure}
+        self.results = {}  # pure: one evaluation per (fonction, arguments)
+        self.fuel = FUEL
+        self.depth = 0
+        self.folded = 0
+
+    def step(self):
+        self.fuel -= 1
+        if self.fuel < 0:
+            raise Stuck
+
+    @staticmethod
+    def key(scope, name):
+        return id(owner(scope, name)), name
+
+    # interpreter, 32-bit entier semantics of the generated code
+
+    def expr(self, tree, scope, env):
+        self.step()
+        if isinstance(tree, Token):
+            if tree.type == "ENTIER":
+                return wrap(int(tree.value))
+            if tree.type == "BOOLEEN":
+                return int(tree.value == "Vrai")
+            if (value := env.get(self.key(scope, tree.value))) is None:
+                raise Stuck
+            return value
+        return getattr(self, "eval_" + tree.data)(tree, scope, env)
+
+    def eval_expr_add(self, tree, scope, env):
+        lhs, op, rhs = tree.children
+        a, b = self.expr(lhs, scope, env), self.expr(rhs, scope, env)
+        return wrap(a + b if op == "+" else a - b)
+
+    def eval_expr_mult(self, tree, scope, env):
+        lhs, op, rhs = tree.children
+        a, b = self.expr(lhs, scope, env), self.expr(rhs, scope, env)
+        if op == "*":
+            return wrap(a * b)
+        q, rem = divide(a, b)
+        return q if op == "/" else rem
+
+    def eval_expr_rel(self, tree, scope, env):
+        lhs, op, rhs = tree.children
+        return int(RELATIONS[op](self.expr(lhs, scope, env), self.expr(rhs, scope, env)))
+
+    def eval_expr_unaire(self, tree, scope, env):
+        return wrap(-self.expr(tree.children[1], scope, env))
+
+    def eval_expr_non(self, tree, scope, env):
+        return int(self.expr(tree.children[1], scope, env) == 0)
+
+    def eval_expr_ou(self, tree, scope, env):
+        a, b = (self.expr(child, scope, env) for child in tree.children)
+        return int(a != 0 or b != 0)
+
+    def eval_expr_et(self, tree, scope, env):
+        a, b = (self.expr(child, scope, env) for child in tree.children)
+        return int(a != 0 and b != 0)
+
+    def eval_appel(self, tree, scope, env):
+        name, args = tree.children
+        if name.value in IO_BUILTINS:
+            raise Stuck
+        obj = scope.get_function(name.value)
+        if (func := self.functions.get(id(obj))) is None or self.depth >= MAX_DEPTH:
+            raise Stuck
+        values = [self.expr(arg, scope, env) for arg in args.children] if args else []
+        if (result := self.results.get((id(obj), *values))) is not None:
+            return result
+        frame = {self.key(func.body_scope, arg): value for (arg, _), value in zip(obj.args, values)}
+        self.depth += 1
+        try:
+            self.bloc(func.children[3], frame, None)
+        except Return as ret:
+            self.results[id(obj), *values] = ret.value
+            return ret.value
+        finally:
+            self.depth -= 1
+        # fell off the end: eax holds whatever was there
+        raise Stuck
+
+    def run(self, stmt, scope, env, outputs):
+        self.step()
+        getattr(self, "exec_" + stmt.data)(stmt, scope, env, outputs)
+
+    def bloc(self, block, env, outputs):
+        for stmt in block.children:
+            self.run(stmt, block.scope, env, outputs)
+
+    def exec_decl(self, stmt, scope, env, outputs):
+        _, name, val = stmt.children
+        env[id(scope), name.value] = self.expr(val, scope, env) if val else 0
+
+    def exec_affectation(self, stmt, scope, env, outputs):
+        name, val = stmt.children
+        env[self.key(scope, name.value)] = self.expr(val, scope, env)
+
+    def exec_expr_instr(self, stmt, scope, env, outputs):
+        val = stmt.children[0]
+        if isinstance(val, Tree) and val.data == "appel" and val.children[0].value == "ecrire":
+            if outputs is None or len(outputs) >= MAX_OUTPUTS:
+                raise Stuck
+            outputs.append(self.expr(val.children[1].children[0], scope, env))
+        else:
+            self.expr(val, scope, env)
+
+    def exec_retourner(self, stmt, scope, env, outputs):
+        raise Return(self.expr(stmt.children[0], scope, env))
+
+    def exec_si(self, stmt, scope, env, outputs):
+        cond, body, *orelse = stmt.children
+        if self.expr(cond, scope, env):
+            self.bloc(body, env, outputs)
+        elif orelse and orelse[0].data == "si":
+            self.run(orelse[0], scope, env, outputs)
+        elif orelse:
+            self.bloc(orelse[0], env, outputs)
+
+    def exec_tantque(self, stmt, scope, env, outputs):
+        cond, body = stmt.children
+        while self.expr(cond, scope, env):
+            self.bloc(body, env, outputs)
+
+    def exec_fonction(self, stmt, scope, env, outputs):
+        pass
+
+    # residualization: what is known at compile time becomes literals
+
+    def statements(self, stmts, scope, env):
+        return [new for stmt in stmts for new in self.statement(stmt, scope, env)]
+
+    def statement(self, stmt, scope, env):
+        # env: values known before stmt, updated to the ones known after it
+        if stmt.data == "fonction":
+            return [stmt]
+        trial, outputs, returned = dict(env), [], None
+        try:
+            self.run(stmt, scope, trial, outputs)
+        except Return as ret:
+            returned = ret.value
+        except (Stuck, RecursionError):
+            self.partial(stmt, scope, env)
+            return [stmt]
+        self.folded += 1
+        residual = list(map(ecrire, outputs))
+        chain = visible(scope)
+        declared = (id(scope), stmt.children[1].value) if stmt.data == "decl" else None
+        for key, value in trial.items():
+            if key[0] in chain and key != declared and env.get(key) != value:
+                var = Tree("affectation", [Token("NOM", key[1]), literal(value, scope.get_variable(key[1]))])
+                var.type = None
+                residual.append(var)
+        if stmt.data == "decl":
+            type, name, _ = stmt.children
+            value = trial[id(scope), name.value]
+            residual.append(Tree("decl", [type, name, literal(value, scope.get_variable(name.value))]))
+        if returned is not None:
+            ret = Tree("retourner", [literal(returned, scope.parent_function.return_type)])
+            ret.type = None
+            residual.append(ret)
+        env.update((key, value) for key, value in trial.items() if key[0] in chain)
+        return residual
+
+    def partial(self, stmt, scope, env):
+        # stmt cannot run here: fold what it computes from known values, then forget what it writes
+        kind = stmt.data
+        if kind == "si":
+            cond, body, *orelse = stmt.children
+            stmt.children[0] = self.fold(cond, scope, env)
+            self.block(body, dict(env))
+            if orelse and orelse[0].data == "si":
+                if (residual := self.statement(orelse[0], scope, dict(env))) != [orelse[0]]:
+                    stmt.children[2] = block = Tree("bloc", residual)
+                    block.scope, block.code = scope, (residual, [])
+            elif orelse:
+                self.block(orelse[0], dict(env))
+        elif kind == "tantque":
+            cond, body = stmt.children
+            variant = written(stmt)
+            inner = {key: value for key, value in env.items() if key[1] not in variant}
+            stmt.children[0] = self.fold(cond, scope, inner)
+            self.block(body, inner)
+        elif kind == "expr_instr" and stmt.children[0].data == "appel":
+            self.fold_args(stmt.children[0], scope, env)
+        else:
+            stmt.children[-1] = self.fold(stmt.children[-1], scope, env)
+        for name in written(stmt):
+            for key in [key for key in env if key[1] == name]:
+                del env[key]
+
+    def block(self, block, env):
+        block.children = self.statements(block.children, block.scope, env)
+        block.code = [stmt for stmt in block.children if stmt.data != "fonction"], block.code[1]
+
+    def fold(self, tree, scope, env):
+        if tree is None or isinstance(tree, Token) and tree.type != "NOM":
+            return tree
+        try:
+            value = self.expr(tree, scope, env)
+        except (Stuck, RecursionError):
+            if isinstance(tree, Tree) and tree.data == "appel":
+                self.fold_args(tree, scope, env)
+            elif isinstance(tree, Tree):
+                tree.children = [self.fold(child, scope, env) for child in tree.children]
+            return tree
+        self.folded += 1
+        return literal(value, scope.get_variable(tree.value) if isinstance(tree, Token) else tree.type)
+
+    def fold_args(self, appel, scope, env):
+        if args := appel.children[1]:
+            args.children = [self.fold(arg, scope, env) for arg in args.children]
+
+
+def partial_evaluate(tree):
+    # run what does not depend on lire at compile time; returns how many statements and expressions were folded
+    evaluator = Evaluator(tree)
+    for func in list(tree.iter_subtrees_topdown()):
+        if func.data == "fonction":
+            evaluator.block(func.children[3], {})
+    stmts, funcs = tree.code
+    stmts = evaluator.statements(stmts, tree.scope, {})
+    tree.code = stmts, funcs
+    tree.children = funcs + stmts
+    return evaluator.folded
@@ -0,0 +1,172 @@
+# coding: utf-8
+from __future__ import annotations
+
+import dataclasses
+import inspect
+import time
+from dataclasses import dataclass, field
+from functools import cache
+from typing import Callable
+
+from src import x86
+from src.x86 import *
+
+
+def opcode(name):
+    cls = getattr(x86, name, None) or getattr(x86, name + "_", None)
+    if not (isinstance(cls, type) and issubclass(cls, Instruction)):
+        raise ValueError(f"unknown opcode {name}")
+    return cls
+
+
+@cache
+def operand_names(cls):
+    return tuple(f.name for f in dataclasses.fields(cls))
+
+
+@dataclass
+class Var:
+    name: str
+
+
+@dataclass
+class Template:
+    cls: type | Var
+    operands: list
+
+
+def parse_operand(text):
+    if text.startswith("$"):
+        return Var(text[1:])
+    if reg := getattr(r, text, None):
+        return reg
+    return imm(int(text))
+
+
+def parse_instr(text):
+    if text.endswith(":"):
+        return Template(label, [parse_operand(text[:-1].strip())])
+    name, _, rest = text.partition(" ")
+    operands = [parse_operand(op.strip()) for op in rest.split(",")] if rest.strip() else []
+    return Template(Var(name[1:]) if name.startswith("$") else opcode(name), operands)
+
+
+def parse_seq(text):
+    return [parse_instr(part.strip()) for part in text.split(";") if part.strip()]
+
+
+def same(pattern, value):
+    if isinstance(pattern, imm):
+        return isinstance(value, imm) and int(value.value) == pattern.value
+    return pattern == value
+
+
+@dataclass
+class Rule:
+    text: str
+    pattern: list[Template]
+    rewrite: list[Template]
+    where: Callable | None = None
+    guard_args: tuple = ()
+
+    def match(self, window):
+        bindings = {}
+        for tpl, instr in zip(self.pattern, window):
+            cls = type(instr)
+            if isinstance(tpl.cls, Var):
+                if bindings.setdefault(tpl.cls.name, cls) is not cls:
+                    return None
+            elif cls is not tpl.cls:
+                return None
+            if cls is label:
+                values = (instr,)
+            else:
+                values = tuple(getattr(instr, name) for name in operand_names(cls))
+            if len(values) != len(tpl.operands):
+                return None
+            for pat, value in zip(tpl.operands, values):
+                if isinstance(pat, Var):
+                    if (bound := bindings.setdefault(pat.name, value)) is not value and bound != value:
+                        return None
+                elif not same(pat, value):
+                    return None
+        if self.where and not self.where(**{name: bindings[name] for name in self.guard_args}):
+            return None
+        return bindings
+
+    def instantiate(self, bindings):
+        res = []
+        for tpl in self.rewrite:
+            values = [bindings[op.name] if isinstance(op, Var) else op for op in tpl.operands]
+            cls = bindings[tpl.cls.name] if isinstance(tpl.cls, Var) else tpl.cls
+            res.append(values[0] if cls is label else cls(*values))
+        return res
+
+
+@dataclass
+class RuleSet:
+    rules: list[Rule] = field(default_factory=list)
+    index: dict[type, list[Rule]] = field(default_factory=dict)
+    generic: list[Rule] = field(default_factory=list)
+    window: int = 1
+    scanned: int = 0
+    elapsed: float = 0.0
+    # accept(old, new): whether a match is worth rewriting
+    accept: Callable | None = None
+
+    def add(self, text, where=None):
+        lhs, rhs = text.split("=>")
+        rule = Rule(text, parse_seq(lhs), parse_seq(rhs), where)
+        if where:
+            rule.guard_args = tuple(inspect.signature(where).parameters)
+        self.rules.append(rule)
+        self.window = max(self.window, len(rule.pattern))
+        first = rule.pattern[0].cls
+        if isinstance(first, Var):
+            self.generic.append(rule)
+            for rules in self.index.values():
+                rules.append(rule)
+        else:
+            self.candidates(first).append(rule)
+        return rule
+
+    def candidates(self, cls):
+        if (rules := self.index.get(cls)) is None:
+            rules = self.index[cls] = list(self.generic)
+        return rules
+
+    def apply(self, instrs: list[Instruction]):
+        start = time.perf_counter()
+        rewrites = []
+        out = []
+        todo = instrs[::-1]
+        limit = 10 * len(instrs) + 100
+        while todo:
+            self.scanned += 1
+            for rule in self.candidates(type(todo[-1])):
+                n = len(rule.pattern)
+                if n > len(todo):
+                    continue
+                window = todo[:-n - 1:-1]
+                if (bindings := rule.match(window)) is None:
+                    continue
+                new = rule.instantiate(bindings)
+                if self.accept and not self.accept(window, new):
+                    continue
+                rewrites.append((window, new))
+                del todo[-n:]
+                todo.extend(reversed(new))
+                for _ in range(min(len(out), self.window - 1)):
+                    todo.append(out.pop())
+                break
+            else:
+                out.append(todo.pop())
+            if len(rewrites) > limit:
+                out.extend(reversed(todo))
+                break
+        instrs[:] = out
+        self.elapsed += time.perf_counter() - start
+        return rewrites
+
+    def throughput(self):
+        return self.scanned / self.elapsed if self.elapsed else 0.0
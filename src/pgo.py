@@ -0,0 +1,39 @@
+# coding: utf-8
+import hashlib
+import json
+from dataclasses import dataclass, field
+
+COUNTERS = "prof$counters"
+
+
+def source_hash(code):
+    return hashlib.sha256(code.encode()).hexdigest()
+
+
+@dataclass
+class Profile:
+    counts: dict[str, int] = field(default_factory=dict)
+    source: str = None
+
+    def __getitem__(self, site):
+        return self.counts.get(site, 0)
+
+    def ratio(self, hot, total):
+        return self[hot] / self[total] if self[total] else 0.0
+
+    @staticmethod
+    def decode(dump: bytes, names, source=None):
+        if len(dump) != 4 * len(names):
+            raise ValueError(f"profile dump has {len(dump)} bytes, expected {4 * len(names)}")
+        counts = {name: int.from_bytes(dump[4 * i:4 * i + 4], "little") for i, name in enumerate(names)}
+        return Profile(counts, source)
+
+    @staticmethod
+    def load(path):
+        with open(path, "r") as f:
+            data = json.load(f)
+        return Profile(data["counts"], data.get("source"))
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({"source": self.source, "counts": self.counts}, f, indent=1)
@@ -0,0 +1,140 @@
+# coding: utf-8
+from dataclasses import dataclass, field
+
+from lark import Token, Tree
+
+from src.analyzer import Function, Scope, Type
+
+IO_BUILTINS = {"ecrire", "lire"}
+MAX_MEMO_ARGS = 3
+
+
+@dataclass
+class FunctionInfo:
+    func: Tree
+    calls: set = field(default_factory=set)
+    does_io: bool = False
+    free_variables: bool = False
+    assigns_args: bool = False
+    loops: bool = False
+    divides: bool = False
+
+
+def safe_division(expr):
+    _, op, divisor = expr.children
+    # idiv runs with edx = 0: dividing a negative number by 1 overflows too
+    return op == "*" or isinstance(divisor, Token) and divisor.type == "ENTIER" and int(divisor) >= 2
+
+
+def owner(scope: Scope, name):
+    while scope is not None and name not in scope.variables:
+        scope = scope.parent
+    return scope
+
+
+class Collector:
+    def __init__(self):
+        self.infos: dict[int, FunctionInfo] = {}
+        self.objects: dict[int, Function] = {}
+
+    def function(self, func):
+        obj = func.func_obj
+        self.objects[id(obj)] = obj
+        self.infos[id(obj)] = info = FunctionInfo(func)
+        self.visit(func.children[3], func.body_scope, info)
+
+    def visit(self, tree, scope, info):
+        if isinstance(tree, Token):
+            if tree.type == "NOM" and info is not None:
+                self.variable(scope, tree.value, info)
+            return
+        if tree.data == "fonction":
+            self.function(tree)
+            return
+        if tree.data == "bloc" and hasattr(tree, "scope"):
+            scope = tree.scope
+        if tree.data == "appel":
+            name, args = tree.children
+            if info is not None:
+                if name.value in IO_BUILTINS:
+                    info.does_io = True
+                else:
+                    info.calls.add(id(scope.get_function(name.value)))
+            if args:
+                self.visit(args, scope, info)
+            return
+        if tree.data == "tantque" and info is not None:
+            info.loops = True
+        if tree.data == "expr_mult" and info is not None and not safe_division(tree):
+            info.divides = True
+        if tree.data == "affectation" and info is not None:
+            found = owner(scope, tree.children[0].value)
+            if found is info.func.scope or found is info.func.body_scope:
+                info.assigns_args = True
+        if tree.data == "decl":
+            _, name, val = tree.children
+            if val is not None:
+                self.visit(val, scope, info)
+            return
+        for child in tree.children:
+            if child is not None:
+                self.visit(child, scope, info)
+
+    def variable(self, scope, name, info):
+        found = owner(scope, name)
+        if found is None or found.parent_function is not info.func.func_obj:
+            info.free_variables = True
+
+
+def analyze_functions(tree):
+    collector = Collector()
+    collector.visit(tree, tree.scope, None)
+    return collector.infos, collector.objects
+
+
+def closed(keys, infos):
+    # largest subset of keys whose functions only call functions of the subset
+    keys = set(keys)
+    changed = True
+    while changed:
+        changed = False
+        for key in list(keys):
+            if not infos[key].calls <= keys:
+                keys.discard(key)
+                changed = True
+    return keys
+
+
+def pure_functions(tree):
+    infos, objects = analyze_functions(tree)
+    pure = {key for key, info in infos.items() if not info.does_io and not info.free_variables}
+    return closed(pure, infos), infos, objects
+
+
+def recursive(key, infos):
+    seen, todo = set(), list(infos[key].calls)
+    while todo:
+        callee = todo.pop()
+        if callee == key:
+            return True
+        if callee not in seen and callee in infos:
+            seen.add(callee)
+            todo.extend(infos[callee].calls)
+    return False
+
+
+def safe_functions(pure, infos):
+    # pure, terminating and unable to trap: may be called speculatively
+    return closed({key for key in pure
+                   if not infos[key].loops and not infos[key].divides and not recursive(key, infos)}, infos)
+
+
+def memo_candidates(tree):
+    pure, infos, objects = pure_functions(tree)
+    return {
+        objects[key].name for key in pure
+        if objects[key].return_type != Type.VOID
+        and 1 <= len(objects[key].args) <= MAX_MEMO_ARGS
+        and not infos[key].assigns_args
+        and recursive(key, infos)
+    }
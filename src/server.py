@@ -0,0 +1,91 @@
+# coding: utf-8
+import json
+import os
+import socket
+import socketserver
+import sys
+
+DEFAULT_SOCKET = "/tmp/flo-compiler.sock"
+CHUNK_LINES = 256
+
+
+class CompileError(Exception):
+    pass
+
+
+def chunks(lines):
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) == CHUNK_LINES:
+            yield "\n".join(chunk) + "\n"
+            chunk = []
+    if chunk:
+        yield "\n".join(chunk) + "\n"
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def send(self, **message):
+        self.wfile.write(json.dumps(message).encode() + b"\n")
+
+    def handle(self):
+        from main import process
+        from src.optimizer import optimize
+
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                prog = process(request["source"])
+                for data in chunks(prog.lines()):
+                    self.send(type="raw", data=data)
+                optimize(prog)
+                for data in chunks(prog.lines()):
+                    self.send(type="asm", data=data)
+                self.send(type="done")
+            except Exception as e:
+                self.send(type="error", message=f"{type(e).__name__}: {e}")
+            self.wfile.flush()
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(path=DEFAULT_SOCKET):
+    from src import optimizer
+    import src.parser  # build the grammar before accepting requests
+
+    optimizer.verbose = False
+    if os.path.exists(path):
+        os.unlink(path)
+    with Server(path, Handler) as server:
+        print(f"listening on {path}", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(path)
+
+
+class Client:
+    def __init__(self, path=DEFAULT_SOCKET):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.rfile = self.sock.makefile("rb")
+
+    def compile(self, source):
+        self.sock.sendall(json.dumps({"source": source}).encode() + b"\n")
+        output = {"raw": [], "asm": []}
+        for line in self.rfile:
+            message = json.loads(line)
+            if message["type"] == "done":
+                return "".join(output["raw"]).rstrip("\n"), "".join(output["asm"]).rstrip("\n")
+            if message["type"] == "error":
+                raise CompileError(message["message"])
+            output[message["type"]].append(message["data"])
+        raise CompileError("connection closed by server")
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
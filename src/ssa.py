@@ -0,0 +1,330 @@
+# coding: utf-8
+import time
+from collections import Counter
+
+from src.ir import BINARY, COMMUTATIVE, UNARY, fold
+
+BOTTOM = "bottom"  # lattice: missing = not yet known, int = constant, BOTTOM = varies
+
+
+def uses_of(func):
+    uses = {}
+    for instr in func.instructions():
+        for arg in instr.args:
+            uses.setdefault(arg, []).append(instr)
+    return uses
+
+
+def reverse_postorder(func):
+    seen, order = {func.entry.id}, []
+    stack = [(func.entry, iter(reversed(func.entry.succs)))]
+    while stack:
+        block, succs = stack[-1]
+        for succ in succs:
+            if succ.id not in seen:
+                seen.add(succ.id)
+                stack.append((succ, iter(reversed(succ.succs))))
+                break
+        else:
+            stack.pop()
+            order.append(block)
+    return order[::-1]
+
+
+def dominators(func):
+    # Cooper, Harvey & Kennedy, "A Simple, Fast Dominance Algorithm"
+    order = reverse_postorder(func)
+    index = {block.id: i for i, block in enumerate(order)}
+    idom = {func.entry.id: func.entry}
+    changed = True
+    while changed:
+        changed = False
+        for block in order[1:]:
+            new = None
+            for pred in block.preds:
+                if pred.id not in idom:
+                    continue
+                if new is None:
+                    new = pred
+                    continue
+                a, b = pred, new
+                while a is not b:
+                    while index[a.id] > index[b.id]:
+                        a = idom[a.id]
+                    while index[b.id] > index[a.id]:
+                        b = idom[b.id]
+                new = a
+            if idom.get(block.id) is not new:
+                idom[block.id] = new
+                changed = True
+    return idom, order
+
+
+def remove_unreachable(func):
+    reachable = {block.id for block in reverse_postorder(func)}
+    dead = [block for block in func.blocks if block.id not in reachable]
+    for block in dead:
+        for succ in list(block.succs):
+            func.unlink(block, succ)
+        for instr in (*block.phis, *block.instrs):
+            if instr.dest is not None:
+                func.defs[instr.dest] = None
+    func.blocks = [block for block in func.blocks if block.id in reachable]
+    return len(dead)
+
+
+def sccp(func, module):
+    # sparse conditional constant propagation (Wegman & Zadeck)
+    uses = uses_of(func)
+    lattice = {}
+    edges = set()
+    reached = set()
+    cfg_work = [(None, func.entry)]
+    ssa_work = []
+
+    def update(value, new):
+        old = lattice.get(value)
+        if old == new or old is BOTTOM:
+            return
+        lattice[value] = new if old is None else BOTTOM
+        ssa_work.extend(uses.get(value, ()))
+
+    def evaluate(instr):
+        op = instr.op
+        if op == "phi":
+            block = instr.block
+            for pred, arg in zip(block.preds, instr.args):
+                if (pred.id, block.id) in edges and (value := lattice.get(arg)) is not None:
+                    update(instr.dest, value)
+        elif op == "const":
+            update(instr.dest, instr.extra)
+        elif op in BINARY or op in UNARY:
+            values = [lattice.get(arg) for arg in instr.args]
+            if op in ("mul", "and") and 0 in values:
+                update(instr.dest, 0)
+            elif BOTTOM in values:
+                update(instr.dest, BOTTOM)
+            elif None not in values:
+                result = fold(op, *values)
+                update(instr.dest, BOTTOM if result is None else result)
+        elif op == "br":
+            cond = lattice.get(instr.args[0])
+            if cond is BOTTOM:
+                cfg_work.extend((instr.block, target) for target in instr.extra)
+            elif cond is not None:
+                cfg_work.append((instr.block, instr.extra[0] if cond else instr.extra[1]))
+        elif op == "jmp":
+            cfg_work.append((instr.block, instr.extra[0]))
+        elif instr.dest is not None:
+            update(instr.dest, BOTTOM)
+
+    while cfg_work or ssa_work:
+        while cfg_work:
+            pred, block = cfg_work.pop()
+            if pred is not None:
+                if (pred.id, block.id) in edges:
+                    continue
+                edges.add((pred.id, block.id))
+            for phi in block.phis:
+                evaluate(phi)
+            if block.id not in reached:
+                reached.add(block.id)
+                for instr in block.instrs:
+                    evaluate(instr)
+        while ssa_work:
+            instr = ssa_work.pop()
+            if instr.block.id in reached:
+                evaluate(instr)
+
+    changes = 0
+    for block in func.blocks:
+        if block.id not in reached:
+            continue
+        folded = []
+        for phi in block.phis:
+            if isinstance(value := lattice.get(phi.dest), int):
+                phi.op, phi.args, phi.extra = "const", [], value
+                folded.append(phi)
+        block.phis = [phi for phi in block.phis if phi.op == "phi"]
+        for instr in block.instrs:
+            if instr.op in BINARY or instr.op in UNARY:
+                if isinstance(value := lattice.get(instr.dest), int):
+                    instr.op, instr.args, instr.extra = "const", [], value
+                    changes += 1
+        block.instrs[:0] = folded
+        changes += len(folded)
+        if (term := block.term) is not None and term.op == "br" and isinstance(cond := lattice.get(term.args[0]), int):
+            taken, dropped = term.extra if cond else term.extra[::-1]
+            term.op, term.args, term.extra = "jmp", [], (taken,)
+            if taken is not dropped:
+                func.unlink(block, dropped)
+            changes += 1
+    return changes + remove_unreachable(func)
+
+
+def dce(func, module):
+    live = set()
+    work = [instr for instr in func.instructions()
+            if instr.has_effects(func) and not (instr.op == "call" and instr.extra in module.removable_calls)]
+    while work:
+        instr = work.pop()
+        if id(instr) in live:
+            continue
+        live.add(id(instr))
+        for arg in instr.args:
+            if (definition := func.defs[arg]) is not None and id(definition) not in live:
+                work.append(definition)
+    removed = 0
+    for block in func.blocks:
+        for instrs in (block.phis, block.instrs):
+            kept = [instr for instr in instrs if id(instr) in live]
+            for instr in instrs:
+                if id(instr) not in live and instr.dest is not None:
+                    func.defs[instr.dest] = None
+            removed += len(instrs) - len(kept)
+            instrs[:] = kept
+    return removed
+
+
+def gvn(func, module):
+    # dominator-based value numbering: an expression computed in a dominator is reused
+    idom, order = dominators(func)
+    children = {}
+    for block in order[1:]:
+        children.setdefault(idom[block.id].id, []).append(block)
+    replaced = {}
+    table = {}
+
+    def find(value):
+        while value in replaced:
+            value = replaced[value]
+        return value
+
+    stack = [(func.entry, None)]
+    while stack:
+        block, saved = stack.pop()
+        if saved is not None:
+            for key in saved:
+                del table[key]
+            continue
+        saved = []
+        for instrs in (block.phis, block.instrs):
+            kept = []
+            for instr in instrs:
+                instr.args = [find(arg) for arg in instr.args]
+                key = None
+                if instr.op == "const":
+                    key = ("const", instr.extra)
+                elif instr.op in BINARY or instr.op in UNARY:
+                    args = sorted(instr.args) if instr.op in COMMUTATIVE else instr.args
+                    key = (instr.op, *args)
+                elif instr.op == "phi":
+                    key = ("phi", block.id, *instr.args)
+                elif instr.op == "call" and instr.extra in module.removable_calls and instr.dest is not None:
+                    key = ("call", instr.extra, *instr.args)
+                if key is not None and (existing := table.get(key)) is not None:
+                    replaced[instr.dest] = existing
+                    func.defs[instr.dest] = None
+                    continue
+                if key is not None:
+                    table[key] = instr.dest
+                    saved.append(key)
+                kept.append(instr)
+            instrs[:] = kept
+        stack.append((block, saved))
+        stack.extend((child, None) for child in reversed(children.get(block.id, ())))
+    func.replace_uses(replaced)
+    return len(replaced)
+
+
+def trivial_phis(func):
+    replaced = {}
+    for block in func.blocks:
+        kept = []
+        for phi in block.phis:
+            args = {arg for arg in phi.args if arg != phi.dest}
+            if len(args) == 1:
+                replaced[phi.dest] = args.pop()
+                func.defs[phi.dest] = None
+            else:
+                kept.append(phi)
+        block.phis = kept
+    func.replace_uses(replaced)
+    return len(replaced)
+
+
+def simplify_cfg(func, module):
+    changes = remove_unreachable(func) + trivial_phis(func)
+    for block in list(func.blocks):
+        term = block.term
+        if block is func.entry or block.phis or len(block.instrs) != 1 or term is None or term.op != "jmp":
+            continue
+        # forward the predecessors of an empty block to its target
+        target = term.extra[0]
+        if target is block:
+            continue
+        index = target.preds.index(block)
+        for pred in list(block.preds):
+            if target in pred.succs:
+                continue
+            pred.term.extra = tuple(target if succ is block else succ for succ in pred.term.extra)
+            pred.succs[pred.succs.index(block)] = target
+            block.preds.remove(pred)
+            target.preds.append(pred)
+            for phi in target.phis:
+                phi.args.append(phi.args[index])
+            changes += 1
+    merged = set()
+    for block in list(func.blocks):
+        # merge a block into its only predecessor when that one only jumps to it
+        if block is func.entry or len(block.preds) != 1:
+            continue
+        pred = block.preds[0]
+        if pred is block or len(pred.succs) != 1:
+            continue
+        func.replace_uses({phi.dest: phi.args[0] for phi in block.phis})
+        for phi in block.phis:
+            func.defs[phi.dest] = None
+        pred.instrs.pop()
+        for instr in block.instrs:
+            instr.block = pred
+        pred.instrs += block.instrs
+        pred.succs = block.succs
+        for succ in block.succs:
+            succ.preds[succ.preds.index(block)] = pred
+        merged.add(block.id)
+        changes += 1
+    func.blocks = [block for block in func.blocks if block.id not in merged]
+    return changes + remove_unreachable(func)
+
+
+class PassManager:
+    def __init__(self, passes=None, max_rounds=10):
+        self.passes = list(DEFAULT_PASSES if passes is None else passes)
+        self.max_rounds = max_rounds
+        self.changes = Counter()
+        self.elapsed = Counter()
+
+    def run(self, module):
+        for func in module.functions.values():
+            self.run_function(func, module)
+        return module
+
+    def run_function(self, func, module):
+        for _ in range(self.max_rounds):
+            changed = 0
+            for pass_ in self.passes:
+                start = time.perf_counter()
+                count = pass_(func, module)
+                self.elapsed[pass_.__name__] += time.perf_counter() - start
+                self.changes[pass_.__name__] += count
+                changed += count
+            if not changed:
+                break
+
+    def summary(self):
+        return ", ".join(f"{name}: {self.changes[name]} changes in {self.elapsed[name] * 1000:.1f}ms"
+                         for name in self.elapsed)
+
+
+DEFAULT_PASSES = [sccp, gvn, dce, simplify_cfg]
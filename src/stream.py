@@ -0,0 +1,120 @@
+# coding: utf-8
+import os
+import re
+
+from lark import Tree
+
+from src.analyzer import GLOBAL_SCOPE, Analyzer, Function, Type
+from src.compiler import Compiler, Program
+from src.licm import hoist_invariants
+from src.optimizer import optimize
+from src.parser import parse
+
+TOKENS = re.compile(r"#[^\n]*|[{}();]")
+SKIP = re.compile(r"(\s|#[^\n]*)*")
+SINON = re.compile(r"(\s|#[^\n]*)*sinon\b")
+HEADER = re.compile(r"(entier|booleen)\s+[^\W\d]\w*\s*\(")
+
+
+def split(code):
+    # top-level items as (start, end, line, is_function), found without parsing them
+    start, depth, line, last = None, 0, 1, 0
+    for match in TOKENS.finditer(code):
+        token = match.group()
+        if token[0] == "#":
+            continue
+        if start is None:
+            start = SKIP.match(code, last).end()
+            line += code.count("\n", last, start)
+        if token in "{(":
+            depth += 1
+            continue
+        if token in "})":
+            depth -= 1
+        if depth or token == ")" or token == "}" and SINON.match(code, match.end()):
+            continue
+        yield start, match.end(), line, bool(HEADER.match(code, start))
+        line += code.count("\n", start, match.end())
+        start, last = None, match.end()
+    if (rest := SKIP.match(code, last).end()) < len(code):
+        # unterminated item: let the parser report it
+        yield rest, len(code), line + code.count("\n", last, rest), False
+
+
+class Stream:
+    # analyze -> compile -> optimize -> emit, one top-level fonction at a time
+    def __init__(self, code, raw_out, out):
+        self.code = code
+        self.raw_out = raw_out
+        self.out = out
+        main = Function("_main", Type.VOID, [])
+        self.scope = GLOBAL_SCOPE.child()
+        self.scope.parent_function = main
+        self.label_count = 0
+
+    @staticmethod
+    def source(line, text):
+        # keep line numbers in parse errors right
+        return "\n" * (line - 1) + text
+
+    def run(self):
+        items = list(split(self.code))
+        for start, end, line, is_function in items:
+            if is_function:
+                # only the signature stays resident
+                header = self.code[start:self.code.index("{", start)]
+                Analyzer(self.scope).declare_function(parse(self.source(line, header + "{}")).children[0])
+        for out in (self.raw_out, self.out):
+            out.write('%include "io.asm"\n')
+            out.write("\n".join(Program.text()) + "\n")
+        for start, end, line, is_function in items:
+            if is_function:
+                self.function(parse(self.source(line, self.code[start:end])))
+        self.main([parse(self.source(line, self.code[start:end])) for start, end, line, is_function in items
+                   if not is_function])
+        for out in (self.raw_out, self.out):
+            out.write("\n".join(Program().bss()) + "\n")
+
+    def function(self, tree):
+        func = tree.children[0]
+        func.func_obj = self.scope.functions[func.children[1].value]
+        Analyzer(self.scope).analyze_function(func)
+        tree.scope, tree.code = self.scope, ([], [func])
+        hoist_invariants(tree)
+        prog = Program(label_count=self.label_count)
+        Compiler(prog, self.scope).compile_function(func)
+        self.emit(prog)
+
+    def main(self, trees):
+        # each statement is parsed on its own: only their ASTs stay resident, not the parser charts
+        stmts = [stmt for part in trees for stmt in part.children]
+        analyzer = Analyzer(self.scope)
+        for stmt in stmts:
+            analyzer.analyze(stmt)
+        tree = Tree("programme", stmts)
+        tree.scope, tree.code = self.scope, (stmts, [])
+        hoist_invariants(tree)
+        prog = Program(label_count=self.label_count)
+        Compiler(prog, self.scope).compile_main(stmts)
+        self.emit(prog)
+
+    def emit(self, prog):
+        self.raw_out.write("\n".join(map(str, prog.instrs)) + "\n")
+        optimize(prog)
+        self.out.write("\n".join(map(str, prog.instrs)) + "\n")
+        self.label_count = prog.label_count
+
+
+def compile_file(path):
+    with open(path, "r") as f:
+        code = f.read()
+    raw_path, asm_path = path.replace(".flo", "_raw.asm"), path.replace(".flo", ".asm")
+    try:
+        with open(raw_path, "w") as raw_out, open(asm_path, "w") as out:
+            Stream(code, raw_out, out).run()
+    except BaseException:
+        # do not leave a truncated .asm behind
+        for output in (raw_path, asm_path):
+            if os.path.exists(output):
+                os.remove(output)
+        raise
@@ -0,0 +1,111 @@
+# coding: utf-8
+import contextlib
+import cProfile
+import gc
+import io
+import json
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+
+from lark import Tree
+
+# what main.process and main.compile_file time, in pipeline order
+PHASES = ["parse", "analyze", "evaluate", "lower", "ssa", "isel", "compile", "asm_raw", "optimize", "asm"]
+
+
+def count_nodes(tree):
+    nodes = 0
+    for subtree in tree.iter_subtrees():
+        nodes += 1 + sum(not isinstance(child, Tree) for child in subtree.children)
+    return nodes
+
+
+class NullTracer:
+    enabled = False
+
+    def phase(self, name):
+        return contextlib.nullcontext()
+
+    def count(self, name, **values):
+        pass
+
+
+NULL_TRACER = NullTracer()
+
+
+class Tracer:
+    enabled = True
+
+    def __init__(self, profile=None):
+        self.events = []
+        self.profile = profile
+        self.profiles = {}
+        self.pid = os.getpid()
+        self.origin = time.perf_counter()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def now(self):
+        return (time.perf_counter() - self.origin) * 1e6
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        profiler = cProfile.Profile() if name == self.profile else None
+        objects = len(gc.get_objects())
+        tracemalloc.reset_peak()
+        mem_before = tracemalloc.get_traced_memory()[0]
+        cpu = time.process_time()
+        start = self.now()
+        if profiler:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler:
+                profiler.disable()
+                self.profiles[name] = profiler
+            end = self.now()
+            current, peak = tracemalloc.get_traced_memory()
+            self.events.append({
+                "name": name,
+                "ph": "X",
+                "ts": start,
+                "dur": end - start,
+                "pid": self.pid,
+                "tid": 0,
+                "args": {
+                    "cpu_ms": (time.process_time() - cpu) * 1000,
+                    "peak_kb": (peak - mem_before) / 1024,
+                    "retained_kb": (current - mem_before) / 1024,
+                    "objects": len(gc.get_objects()) - objects,
+                },
+            })
+
+    def count(self, name, **values):
+        self.events.append({"name": name, "ph": "C", "ts": self.now(), "pid": self.pid, "args": values})
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f, indent=1)
+
+    def dump_profiles(self, path):
+        # next to the trace file: prog.trace.json -> prog.trace.PHASE.prof
+        for name, profiler in self.profiles.items():
+            prof_path = os.path.splitext(path)[0] + f".{name}.prof"
+            profiler.dump_stats(prof_path)
+
+    def summary(self, file=sys.stderr):
+        for event in self.events:
+            if event["ph"] == "X":
+                args = event["args"]
+                print(f"{event['name']:10s} wall {event['dur'] / 1000:9.2f}ms  cpu {args['cpu_ms']:9.2f}ms  "
+                      f"peak {args['peak_kb']:9.1f}KiB  objects {args['objects']:+8d}", file=file)
+            else:
+                print(f"{event['name']:10s} " + " ".join(f"{k}={v}" for k, v in event["args"].items()), file=file)
+        for name, profiler in self.profiles.items():
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(15)
+            print(f"profile of {name}:\n{out.getvalue()}", file=file)
@@ -0,0 +1,66 @@
+# coding: utf-8
+import random
+
+
+def gen_functions(n, rng):
+    lines = []
+    for k in range(n):
+        lines.append(f"entier f{k}(entier a, entier b) {{")
+        lines.append(f"    entier t = a * {rng.randint(1, 9)} + b;")
+        lines.append(f"    si (t > {rng.randint(0, 50)}) {{")
+        lines.append(f"        retourner t - {k};")
+        lines.append("    }")
+        lines.append(f"    retourner t + {k};")
+        lines.append("}")
+    for k in range(n):
+        lines.append(f"ecrire(f{k}({rng.randint(0, 20)}, {rng.randint(0, 20)}));")
+    return "\n".join(lines) + "\n"
+
+
+def gen_expression(n, rng):
+    expr = str(rng.randint(1, 9))
+    for k in range(n):
+        op = rng.choice("+-*")
+        term = str(rng.randint(1, 9))
+        if k % 7 == 6:
+            expr = f"({expr})"
+        expr = f"{expr} {op} {term}"
+    return f"entier x = 1;\necrire({expr});\necrire(x + {expr});\n"
+
+
+def gen_nesting(n, rng):
+    lines = ["entier x = 0;"]
+    for k in range(n):
+        indent = "    " * k
+        if k % 2:
+            lines.append(f"{indent}entier i{k} = 0;")
+            lines.append(f"{indent}tantque (i{k} < 1) {{")
+            lines.append(f"{indent}    i{k} = i{k} + 1;")
+        else:
+            lines.append(f"{indent}si (x >= {-k}) {{")
+        lines.append(f"{indent}    x = x + {rng.randint(1, 9)};")
+    for k in reversed(range(n)):
+        lines.append("    " * k + "}")
+    lines.append("ecrire(x);")
+    return "\n".join(lines) + "\n"
+
+
+def gen_loops(n, rng):
+    lines = ["entier i = 0;", "entier s = 0;", "tantque (i < 100) {"]
+    for k in range(n):
+        lines.append(f"    entier v{k} = i * {rng.randint(1, 9)} + s % {rng.randint(2, 9)};")
+        lines.append(f"    si (v{k} > {rng.randint(0, 100)}) {{ s = s + v{k}; }} sinon {{ s = s - 1; }}")
+    lines += ["    i = i + 1;", "}", "ecrire(s);"]
+    return "\n".join(lines) + "\n"
+
+
+SHAPES = {
+    "functions": gen_functions,
+    "expression": gen_expression,
+    "nesting": gen_nesting,
+    "loops": gen_loops,
+}
+
+
+def generate(shape, size, seed=0):
+    return SHAPES[shape](size, random.Random(f"{shape}/{size}/{seed}"))
@@ -1,11 +1,14 @@
 # coding: utf-8
 from __future__ import annotations
 
-from dataclasses import dataclass
-from typing import Union, Optional
+import math
+from dataclasses import astuple, dataclass, replace
+from typing import Union, Optional, ClassVar
 
 frozendata = lambda x: dataclass(frozen=True)(x)
 
+FLAGS = "flags"
+
 
 @dataclass(init=False)
 class Register:
@@ -20,6 +23,16 @@ class Register:
     def __hash__(self):
         return hash(self.name)
 
+    @property
+    def is_byte(self):
+        return len(self.name) == 2 and self.name.endswith("l")
+
+    @property
+    def full(self) -> Register:
+        if self.is_byte:
+            return getattr(r, f"e{self.name[0]}x")
+        return self
+
 
 class r:
     al = Register()
@@ -28,18 +41,38 @@ class r:
     ecx = Register()
     cl = Register()
     edx = Register()
+    esi = Register()
+    edi = Register()
     ebp = Register()
     esp = Register()
 
 
+GENERAL_REGISTERS = (r.eax, r.ebx, r.ecx, r.edx)
+# never touched by the io.asm routines; a Flo function that uses them saves them
+CALLEE_SAVED = (r.esi, r.edi)
+
+
+# (reads, writes) of the io.asm routines, flags excluded; anything else is assumed to clobber everything
+ROUTINE_EFFECTS = {
+    "readline": ({r.eax}, set()),
+    "atoi": ({r.eax}, {r.eax}),
+    "iprintLF": ({r.eax}, {r.ebx}),
+}
+CALL_EFFECTS = (set(GENERAL_REGISTERS), set(GENERAL_REGISTERS))
+# internal calls (regparm(3) style): the first arguments in these, the rest pushed right to left;
+# GENERAL_REGISTERS are caller-saved, CALLEE_SAVED and ebp are callee-saved, the result is in eax
+ARG_REGISTERS = (r.eax, r.edx, r.ecx)
+
+
 @frozendata
 class Memory:
-    base: Register
+    base: Optional[Register]
     offset: int = 0
     index_scale: Optional[(Register, Union[1, 2, 4, 8])] = None
+    symbol: Optional[str] = None
 
     def __str__(self):
-        items = str(self.base)
+        items = "+".join(str(x) for x in (self.symbol, self.base) if x)
         if self.index_scale:
             index, scale = self.index_scale
             items += "+"
@@ -52,6 +85,12 @@ class Memory:
             items += str(self.offset)
         return f"dword [{items}]"
 
+    def registers(self):
+        regs = {self.base.full} if self.base else set()
+        if self.index_scale:
+            regs.add(self.index_scale[0].full)
+        return regs
+
 
 @frozendata
 class Immediate:
@@ -74,9 +113,130 @@ class Global(Immediate):
         return self.name
 
 
+# static cost model, Skylake-like figures
+LOAD_LATENCY = 4  # L1 hit, also roughly a store-to-load forward
+ISSUE_WIDTH = 4  # fused uops per cycle
+
+
+@frozendata
+class Cost:
+    # for a sequence, latency is its critical path
+    latency: int = 0
+    uops: int = 0
+    size: int = 0
+    loads: int = 0
+    stores: int = 0
+
+    def __add__(self, other):
+        return Cost(*(a + b for a, b in zip(astuple(self), astuple(other))))
+
+    @property
+    def cycles(self):
+        return max(self.latency, math.ceil(self.uops / ISSUE_WIDTH))
+
+    def key(self):
+        return self.cycles, self.uops, self.size
+
+
+def short(value):
+    return isinstance(value, imm) and -128 <= value.value < 128
+
+
+def operand_size(op):
+    # ModRM extension bytes: SIB and displacement
+    if not isinstance(op, Memory):
+        return 0
+    sib = 1 if op.index_scale or op.base == r.esp else 0
+    if op.symbol or op.base is None:
+        return sib + 4
+    if op.offset == 0 and op.base != r.ebp:
+        return sib
+    return sib + (1 if -128 <= op.offset < 128 else 4)
+
+
+def immediate_size(op):
+    if not isinstance(op, Immediate):
+        return 0
+    return 1 if short(op) else 4
+
+
+def block_cost(instrs) -> Cost:
+    ready = {}
+    total = Cost()
+    for instr in instrs:
+        cost = instr.cost()
+        end = max((ready.get(loc, 0) for loc in instr.reads()), default=0) + cost.latency
+        for loc in instr.writes():
+            ready[loc] = end
+        total += replace(cost, latency=0)
+    return replace(total, latency=max(ready.values(), default=0))
+
+
+def program_cost(instrs) -> Cost:
+    # sum over the basic blocks, each one costed on its own
+    total, start = Cost(), 0
+    for i, instr in enumerate(instrs):
+        if isinstance(instr, label) and i > start:
+            total, start = total + block_cost(instrs[start:i]), i
+        if isinstance(instr, (jmp, je, jne, ret, int_)):
+            total, start = total + block_cost(instrs[start:i + 1]), i + 1
+    return total + block_cost(instrs[start:])
+
+
+def reads_of(op):
+    if isinstance(op, Register):
+        return {op.full}
+    if isinstance(op, Memory):
+        return {op} | op.registers()
+    return set()
+
+
+def writes_of(op):
+    if isinstance(op, (Register, Memory)):
+        return {op.full if isinstance(op, Register) else op}
+    return set()
+
+
 @frozendata
 class Instruction:
-    pass
+    reads_dst: ClassVar[bool] = False
+    writes_flags: ClassVar[bool] = False
+    reads_flags: ClassVar[bool] = False
+    # cost model: result latency and fused uops with register operands, opcode and ModRM bytes
+    latency: ClassVar[int] = 1
+    uops: ClassVar[int] = 1
+    encoding: ClassVar[int] = 2
+    stores_dst: ClassVar[bool] = True  # cmp only reads its dst
+
+    def reads(self):
+        res = reads_of(getattr(self, "src", None))
+        if dst := getattr(self, "dst", None):
+            if self.reads_dst or (isinstance(dst, Register) and dst.is_byte):
+                res |= reads_of(dst)
+            elif isinstance(dst, Memory):
+                res |= dst.registers()
+        if self.reads_flags:
+            res.add(FLAGS)
+        return res
+
+    def writes(self):
+        res = writes_of(getattr(self, "dst", None))
+        if self.writes_flags:
+            res.add(FLAGS)
+        return res
+
+    def memory_accesses(self):
+        dst, src = getattr(self, "dst", None), getattr(self, "src", None)
+        loads = isinstance(src, Memory) or isinstance(dst, Memory) and (self.reads_dst or not self.stores_dst)
+        return int(loads), int(isinstance(dst, Memory) and self.stores_dst)
+
+    def size(self):
+        dst, src = getattr(self, "dst", None), getattr(self, "src", None)
+        return self.encoding + operand_size(dst) + operand_size(src) + immediate_size(src)
+
+    def cost(self) -> Cost:
+        loads, stores = self.memory_accesses()
+        return Cost(self.latency + LOAD_LATENCY * loads, self.uops + loads + stores, self.size(), loads, stores)
 
 
 @frozendata
@@ -91,6 +251,21 @@ class label(Instruction):
     def __str__(self):
         return f"{self.name}:"
 
+    def cost(self):
+        return Cost()
+
+
+@frozendata
+class align(Instruction):
+    value: int
+
+    def __str__(self):
+        return f"align {self.value}"
+
+    def cost(self):
+        # padding only when the label it precedes is not aligned yet
+        return Cost()
+
 
 @frozendata
 class mov(Instruction):
@@ -100,17 +275,35 @@ class mov(Instruction):
     def __str__(self):
         return f"mov {self.dst}, {self.src}"
 
+    def size(self):
+        if isinstance(self.src, Immediate):
+            # B8+r id, or C7 /0 with a ModRM
+            return 5 if isinstance(self.dst, Register) else 6 + operand_size(self.dst)
+        return super().size()
+
 
 @frozendata
 class int_(Instruction):
+    latency = 100  # kernel entry and exit
+    uops = 10
+
     value: int
 
     def __str__(self):
         return f"int 0x{self.value:02x}"
 
+    def reads(self):
+        return set(GENERAL_REGISTERS)
+
+    def writes(self):
+        return {r.eax, FLAGS}
+
 
 @frozendata
 class add(Instruction):
+    reads_dst = True
+    writes_flags = True
+
     dst: Register | Memory
     src: Register | Memory | Immediate
 
@@ -120,6 +313,9 @@ class add(Instruction):
 
 @frozendata
 class sub(Instruction):
+    reads_dst = True
+    writes_flags = True
+
     dst: Register | Memory
     src: Register | Memory | Immediate
 
@@ -129,12 +325,19 @@ class sub(Instruction):
 
 @frozendata
 class cmp(Instruction):
+    reads_dst = True
+    writes_flags = True
+    stores_dst = False
+
     dst: Register | Memory
     src: Register | Memory | Immediate
 
     def __str__(self):
         return f"cmp {self.dst}, {self.src}"
 
+    def writes(self):
+        return {FLAGS}
+
 
 @frozendata
 class push(Instruction):
@@ -143,6 +346,22 @@ class push(Instruction):
     def __str__(self):
         return f"push {self.src}"
 
+    def reads(self):
+        return super().reads() | {r.esp}
+
+    def writes(self):
+        return {r.esp}
+
+    def memory_accesses(self):
+        return int(isinstance(self.src, Memory)), 1
+
+    def size(self):
+        if isinstance(self.src, Register):
+            return 1
+        if isinstance(self.src, Immediate):
+            return 1 + immediate_size(self.src)
+        return 2 + operand_size(self.src)
+
 
 @frozendata
 class pop(Instruction):
@@ -151,20 +370,61 @@ class pop(Instruction):
     def __str__(self):
         return f"pop {self.dst}"
 
+    def reads(self):
+        return super().reads() | {r.esp}
+
+    def writes(self):
+        return super().writes() | {r.esp}
+
+    def memory_accesses(self):
+        return 1, int(isinstance(self.dst, Memory))
+
+    def size(self):
+        return 1 if isinstance(self.dst, Register) else 2 + operand_size(self.dst)
+
 
 @frozendata
 class ret(Instruction):
+    latency = 2
+    encoding = 1
+
     def __str__(self):
         return "ret"
 
+    def reads(self):
+        return {r.eax, r.esp, *CALLEE_SAVED}
+
+    def writes(self):
+        return {r.esp}
+
+    def memory_accesses(self):
+        return 1, 0
+
 
 @frozendata
 class call(AltersFlow):
+    latency = 2
+    uops = 2
+    encoding = 5
+
     dst: str
+    # arguments passed in ARG_REGISTERS, None for a call outside the Flo program
+    register_args: Optional[int] = None
 
     def __str__(self):
         return f"call {self.dst}"
 
+    def reads(self):
+        if self.register_args is not None:
+            return set(ARG_REGISTERS[:self.register_args]) | {r.esp}
+        return ROUTINE_EFFECTS.get(self.dst, CALL_EFFECTS)[0] | {r.esp}
+
+    def writes(self):
+        return ROUTINE_EFFECTS.get(self.dst, CALL_EFFECTS)[1] | {FLAGS}
+
+    def memory_accesses(self):
+        return 0, 1
+
 
 @frozendata
 class jmp(AltersFlow):
@@ -176,6 +436,9 @@ class jmp(AltersFlow):
 
 @frozendata
 class sete(Instruction):
+    reads_flags = True
+    encoding = 3
+
     dst: Register | Memory
 
     def __str__(self):
@@ -184,6 +447,9 @@ class sete(Instruction):
 
 @frozendata
 class setne(Instruction):
+    reads_flags = True
+    encoding = 3
+
     dst: Register | Memory
 
     def __str__(self):
@@ -192,6 +458,9 @@ class setne(Instruction):
 
 @frozendata
 class setl(Instruction):
+    reads_flags = True
+    encoding = 3
+
     dst: Register | Memory
 
     def __str__(self):
@@ -200,6 +469,9 @@ class setl(Instruction):
 
 @frozendata
 class setle(Instruction):
+    reads_flags = True
+    encoding = 3
+
     dst: Register | Memory
 
     def __str__(self):
@@ -208,6 +480,9 @@ class setle(Instruction):
 
 @frozendata
 class setg(Instruction):
+    reads_flags = True
+    encoding = 3
+
     dst: Register | Memory
 
     def __str__(self):
@@ -216,6 +491,9 @@ class setg(Instruction):
 
 @frozendata
 class setge(Instruction):
+    reads_flags = True
+    encoding = 3
+
     dst: Register | Memory
 
     def __str__(self):
@@ -224,6 +502,8 @@ class setge(Instruction):
 
 @frozendata
 class movzx(Instruction):
+    encoding = 3
+
     dst: Register | Memory
     src: Register | Memory
 
@@ -233,14 +513,29 @@ class movzx(Instruction):
 
 @frozendata
 class je(AltersFlow):
+    reads_flags = True
+
     dst: label
 
     def __str__(self):
         return f"je {self.dst.name}"
 
 
+@frozendata
+class jne(AltersFlow):
+    reads_flags = True
+
+    dst: label
+
+    def __str__(self):
+        return f"jne {self.dst.name}"
+
+
 @frozendata
 class neg(Instruction):
+    reads_dst = True
+    writes_flags = True
+
     dst: Register | Memory
 
     def __str__(self):
@@ -249,6 +544,11 @@ class neg(Instruction):
 
 @frozendata
 class imul(Instruction):
+    reads_dst = True
+    writes_flags = True
+    latency = 3
+    encoding = 3
+
     dst: Register
     src: Register | Memory
 
@@ -258,14 +558,26 @@ class imul(Instruction):
 
 @frozendata
 class idiv(Instruction):
+    latency = 26
+    uops = 10
+
     src: Register | Memory
 
     def __str__(self):
         return f"idiv {self.src}"
 
+    def reads(self):
+        return super().reads() | {r.eax, r.edx}
+
+    def writes(self):
+        return {r.eax, r.edx, FLAGS}
+
 
 @frozendata
 class or_(Instruction):
+    reads_dst = True
+    writes_flags = True
+
     dst: Register | Memory
     src: Register | Memory | Immediate
 
@@ -275,6 +587,9 @@ class or_(Instruction):
 
 @frozendata
 class and_(Instruction):
+    reads_dst = True
+    writes_flags = True
+
     dst: Register | Memory
     src: Register | Memory | Immediate
 
@@ -284,11 +599,25 @@ class and_(Instruction):
 
 @frozendata
 class nop(Instruction):
+    encoding = 1
+
     def __str__(self):
         return "nop"
 
 
 @frozendata
 class leave(AltersFlow):
+    uops = 3
+    encoding = 1
+
     def __str__(self):
         return "leave"
+
+    def reads(self):
+        return {r.ebp}
+
+    def writes(self):
+        return {r.esp, r.ebp}
+
+    def memory_accesses(self):
+        return 1, 0